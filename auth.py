@@ -0,0 +1,132 @@
+import hashlib
+import hmac
+import threading
+import time
+import collections
+import logging
+
+import db
+
+logger = logging.getLogger(__name__)
+
+
+class LoginThrottled(Exception):
+    """Demasiados intentos de login; reintentar en `retry_after` segundos"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Demasiados intentos, reintenta en {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# ------------------------------------------------------------------
+# 🪣 Límite de intentos (token bucket)
+# ------------------------------------------------------------------
+class RateLimiter:
+    """Un token bucket por clave (IP o usuario), en memoria.
+
+    Cada clave tiene hasta `burst` intentos que se recargan a `rate` por
+    segundo. Sólo se recuerdan las `max_keys` claves más recientes, así un
+    barrido de IPs no hace crecer la memoria sin límite.
+    """
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()  # clave -> [tokens, momento]
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Consume un intento; devuelve 0 si se permite o los segundos de espera."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = [float(self.burst), now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if bucket[0] < 1:
+                return (1 - bucket[0]) / self.rate
+            bucket[0] -= 1
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+# ------------------------------------------------------------------
+# 🔑 Login
+# ------------------------------------------------------------------
+def _digest(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def is_bcrypt_hash(text):
+    return text.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+class LoginManager:
+    """Verifica credenciales descartando primero el abuso barato de filtrar.
+
+    Orden: límite por IP, límite por usuario, cuenta admin de la
+    configuración (en memoria) y por último usuarios de la DB, cuyo bcrypt
+    corre en el pool acotado de db (HashPoolBusy si está lleno).
+
+    La contraseña admin puede guardarse como hash bcrypt (lo que escribe
+    /upd-pwd) o en texto plano heredado; en ese caso sólo se conserva su
+    SHA-256 en memoria y se compara en tiempo constante.
+    """
+
+    def __init__(self, admin, ip_rate=0.2, ip_burst=10, user_rate=0.05, user_burst=5):
+        self.by_ip = RateLimiter(ip_rate, ip_burst)
+        self.by_user = RateLimiter(user_rate, user_burst)
+        self.set_admin(admin)
+
+    def set_admin(self, admin):
+        """Carga la cuenta admin (también al recargar la configuración)."""
+        password = admin.get("password") or ""
+        self._admin_user = _digest(admin.get("username") or "")
+        self._admin_name = admin.get("username")
+        if is_bcrypt_hash(password):
+            self._admin_hash, self._admin_digest = password, None
+        else:
+            self._admin_hash = None
+            self._admin_digest = _digest(password) if password else None
+
+    def _check_admin(self, username, password):
+        # compare_digest sobre digests de igual largo: no filtra por tiempo
+        if not hmac.compare_digest(_digest(username), self._admin_user):
+            return False
+        if self._admin_hash is not None:
+            return db.verify_password(password, self._admin_hash)
+        if self._admin_digest is None:
+            return False
+        return hmac.compare_digest(_digest(password), self._admin_digest)
+
+    def authenticate(self, ip, username, password):
+        """Devuelve {id, nombre, tipo} o None; LoginThrottled si hay que esperar."""
+        wait = self.by_ip.take(ip)
+        user_key = username.strip().lower()
+        wait = wait or self.by_user.take(user_key)
+        if wait:
+            logger.warning(f"🚫 Login limitado para {username!r} desde {ip}")
+            raise LoginThrottled(wait)
+
+        if self._check_admin(username, password):
+            usuario = {
+                "id": self._admin_name,
+                "nombre": self._admin_name,
+                "tipo": self._admin_name,
+            }
+        else:
+            row = db.verificar_usuario(username, password)
+            if row is None:
+                return None
+            usuario = {"id": row["id"], "nombre": row["nombre"], "tipo": row["tipo"]}
+        self.by_user.reset(user_key)
+        return usuario
@@ -0,0 +1,126 @@
+import threading
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ------------------------------------------------------------------
+# ⚙️ Modo del servidor
+# ------------------------------------------------------------------
+# "werkzeug": servidor de desarrollo, un hilo por cliente.
+# "gevent": servidor cooperativo (gevent.pywsgi); los clientes MJPEG, SSE y
+#   SocketIO son greenlets. La cámara, el lector NFC, el GPIO, la cerradura
+#   y bcrypt siguen en hilos reales y hablan con el hub a través del puente.
+MODES = ("werkzeug", "gevent")
+
+
+def monkey_patch(mode):
+    """En modo gevent parchea sockets, sin tocar threading, time ni select:
+    los hilos de hardware deben seguir siendo hilos del sistema."""
+    if mode == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all(thread=False, time=False, select=False, subprocess=False)
+
+
+def create_bridge(mode):
+    if mode == "gevent":
+        return GeventBridge()
+    return ThreadBridge()
+
+
+# ------------------------------------------------------------------
+# 🔔 Notificadores: despertar esperas desde cualquier hilo
+# ------------------------------------------------------------------
+class ThreadNotifier:
+    """Pulso reutilizable para hilos reales.
+
+    Quien espera toma `event` antes de revisar su condición y luego llama
+    a event.wait(); notify() cambia el evento por uno nuevo y activa el
+    anterior, así ninguna notificación se pierde entre revisar y esperar.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.event = threading.Event()
+
+    def notify(self):
+        with self._lock:
+            event, self.event = self.event, threading.Event()
+        event.set()
+
+
+class GreenNotifier:
+    """Igual que ThreadNotifier pero para greenlets; notify() es seguro
+    desde cualquier hilo porque el cambio de evento se hace en el hub."""
+
+    def __init__(self, bridge):
+        from gevent.event import Event
+
+        self._Event = Event
+        self._bridge = bridge
+        self.event = Event()
+
+    def _fire(self):
+        event, self.event = self.event, self._Event()
+        event.set()
+
+    def notify(self):
+        self._bridge.call_soon(self._fire)
+
+
+# ------------------------------------------------------------------
+# 🌉 Puentes hilo -> servidor
+# ------------------------------------------------------------------
+class ThreadBridge:
+    """Modo werkzeug: todo corre en hilos, las llamadas son directas."""
+
+    async_mode = "threading"
+    cooperative = False
+
+    def call(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+    call_soon = call
+
+    def notifier(self):
+        return ThreadNotifier()
+
+    def executor(self, max_workers, thread_name_prefix=""):
+        return ThreadPoolExecutor(max_workers, thread_name_prefix=thread_name_prefix)
+
+
+class GeventBridge:
+    """Modo gevent: las llamadas desde hilos reales se encolan en el hub.
+
+    call() ejecuta la función en un greenlet nuevo (puede cooperar, p. ej.
+    socketio.emit); call_soon() la ejecuta directo en el hub y sólo sirve
+    para funciones que no bloquean.
+    """
+
+    async_mode = "gevent"
+    cooperative = True
+
+    def __init__(self):
+        import gevent
+
+        self._gevent = gevent
+        self._hub = gevent.get_hub()
+
+    def call(self, fn, *args, **kwargs):
+        self._hub.loop.run_callback_threadsafe(
+            self._gevent.spawn, functools.partial(fn, *args, **kwargs)
+        )
+
+    def call_soon(self, fn, *args):
+        self._hub.loop.run_callback_threadsafe(fn, *args)
+
+    def notifier(self):
+        return GreenNotifier(self)
+
+    def executor(self, max_workers, thread_name_prefix=""):
+        # Hilos nativos cuyo future.result() coopera con el hub
+        from gevent.threadpool import ThreadPoolExecutor as GeventExecutor
+
+        return GeventExecutor(max_workers)
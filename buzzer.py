@@ -1,49 +1,130 @@
-import RPi.GPIO as GPIO
 import time
 import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Patrones: (prioridad, [(encendido, silencio), ...]) en segundos.
+# Uno de mayor prioridad interrumpe al que suena y descarta los menores.
+PATTERNS = {
+    "success": (1, [(0.1, 0.1)]),  # Un beep corto
+    "timbre": (1, [(0.4, 0.0)]),  # Beep largo del timbre
+    "error": (3, [(0.3, 0.05)] * 3),  # Tres beeps largos
+    "warning": (2, [(0.2, 0.1)] * 2),  # Dos beeps medios
+    "notification": (0, [(0.05, 0.02)] * 2),  # Doble beep rápido
+    "startup": (0, [(0.1, 0.1), (0.05, 0.05), (0.05, 0.1)]),  # Beep-doble-beep
+}
+BEEP_PRIORITY = 1  # prioridad de beep() sueltos
+QUEUE_SIZE = 8
 
 
 class BuzzerManager:
-    def __init__(self, buzzer_pin=18):
+    """Dueño único del pin del buzzer.
+
+    Un solo hilo ("buzzer") toca los patrones en orden con tiempos
+    monótonos; beep() y alert_pattern() sólo encolan y regresan de
+    inmediato, así ni el lector ni el timbre esperan al sonido.
+    """
+
+    def __init__(self, gpio, buzzer_pin=18, queue_size=QUEUE_SIZE):
+        self.gpio = gpio  # RPi.GPIO o gpioModule.SimulatedGPIO
         self.buzzer_pin = buzzer_pin
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._pending = collections.deque()  # (prioridad, pasos)
+        self._current = None  # prioridad del patrón que suena
+        self._preempt = False
+        self._cond = threading.Condition()
+        self._running = True
         self.setup_buzzer()
+        self._thread = threading.Thread(target=self._run, name="buzzer", daemon=True)
+        self._thread.start()
 
     def setup_buzzer(self):
         """Configura el GPIO para el buzzer"""
         try:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setup(self.buzzer_pin, GPIO.OUT)
-            GPIO.output(self.buzzer_pin, GPIO.LOW)
-            print(f"✅ Buzzer configurado en pin GPIO {self.buzzer_pin}")
+            self.gpio.setmode(self.gpio.BCM)
+            self.gpio.setup(self.buzzer_pin, self.gpio.OUT)
+            self.gpio.output(self.buzzer_pin, self.gpio.LOW)
+            logger.info(f"✅ Buzzer configurado en pin GPIO {self.buzzer_pin}")
         except Exception as e:
-            print(f"❌ Error configurando buzzer: {e}")
+            logger.error(f"❌ Error configurando buzzer: {e}")
+
+    def play(self, steps, priority=BEEP_PRIORITY):
+        """Encola [(encendido, silencio), ...]; devuelve False si se descartó."""
+        with self._cond:
+            if not self._running:
+                return False
+            if self._current is not None and priority > self._current:
+                self._preempt = True
+            if any(p < priority for p, _ in self._pending):
+                self._pending = collections.deque(
+                    item for item in self._pending if item[0] >= priority
+                )
+            if len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                return False
+            self._pending.append((priority, list(steps)))
+            self._cond.notify()
+            return True
 
     def beep(self, duration=0.1, times=1, delay=0.1):
-        """Emite sonido del buzzer"""
+        """Emite sonido del buzzer (sin bloquear)"""
+        return self.play([(duration, delay)] * times)
 
-        def beep_thread():
-            for _ in range(times):
-                GPIO.output(self.buzzer_pin, GPIO.HIGH)
-                time.sleep(duration)
-                GPIO.output(self.buzzer_pin, GPIO.LOW)
-                time.sleep(delay)
+    def alert_pattern(self, pattern_type="success"):
+        """Patrones predefinidos de sonido (ver PATTERNS)"""
+        if pattern_type not in PATTERNS:
+            return False
+        priority, steps = PATTERNS[pattern_type]
+        return self.play(steps, priority)
 
-        threading.Thread(target=beep_thread, daemon=True).start()
+    def _wait(self, deadline):
+        """Espera hasta `deadline`; devuelve False si hay que cortar el patrón."""
+        with self._cond:
+            while self._running and not self._preempt:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self._cond.wait(remaining)
+            return False
 
-    def alert_pattern(self, pattern_type="success"):
-        """Patrones predefinidos de sonido"""
-        patterns = {
-            "success": [(0.1, 1)],  # Un beep corto
-            "error": [(0.3, 3, 0.05)],  # Tres beeps largos
-            "warning": [(0.2, 2, 0.1)],  # Dos beeps medios
-            "notification": [(0.05, 2, 0.02)],  # Doble beep rápido
-            "startup": [(0.1, 1), (0.05, 0), (0.1, 1)],  # Beep-doble-beep
-        }
-
-        if pattern_type in patterns:
-            for pattern in patterns[pattern_type]:
-                self.beep(*pattern)
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                priority, steps = self._pending.popleft()
+                self._current = priority
+                self._preempt = False
+            try:
+                # Cada paso se programa desde el anterior, no desde "ahora":
+                # la latencia de despertar no se acumula a lo largo del patrón
+                deadline = time.monotonic()
+                for on, off in steps:
+                    self.gpio.output(self.buzzer_pin, self.gpio.HIGH)
+                    deadline += on
+                    cortar = not self._wait(deadline)
+                    self.gpio.output(self.buzzer_pin, self.gpio.LOW)
+                    if cortar:
+                        break
+                    deadline += off
+                    if not self._wait(deadline):
+                        break
+            except Exception as e:
+                logger.error(f"⚠️ Error tocando el buzzer: {e}")
+            finally:
+                with self._cond:
+                    self._current = None
 
     def cleanup(self):
-        """Limpia los recursos GPIO"""
-        GPIO.output(self.buzzer_pin, GPIO.LOW)
+        """Detiene el hilo y limpia los recursos GPIO"""
+        with self._cond:
+            self._running = False
+            self._pending.clear()
+            self._cond.notify_all()
+        self._thread.join(timeout=1)
+        self.gpio.output(self.buzzer_pin, self.gpio.LOW)
@@ -0,0 +1,704 @@
+import io, threading, time, logging, collections
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_STAGE_HELP = "Latencia por etapa del pipeline de cámara"
+_capture_hist = metrics.histogram(
+    "vport_camera_stage_seconds", _STAGE_HELP, stage="capture"
+)
+_encode_hist = metrics.histogram(
+    "vport_camera_stage_seconds", _STAGE_HELP, stage="encode"
+)
+_publish_hist = metrics.histogram(
+    "vport_camera_stage_seconds", _STAGE_HELP, stage="publish"
+)
+
+
+# ------------------------------------------------------------------
+# 📡 Difusión de frames
+# ------------------------------------------------------------------
+class FrameBroadcaster:
+    """Reparte el último frame JPEG a todos los clientes del stream.
+
+    Cada frame publicado recibe un número de secuencia y avisa a los
+    listeners (el notificador del puente); los clientes toman latest()
+    cuando hay un frame más nuevo que el último que enviaron. Si un
+    cliente es lento simplemente salta al más reciente, nunca se encolan
+    frames viejos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self.clients = 0
+        self._listeners = []
+        self.published_at = 0.0  # metrics.now() del último frame
+
+    @property
+    def seq(self):
+        return self._seq
+
+    def subscribe(self):
+        """Registra un cliente del stream."""
+        with self._lock:
+            self.clients += 1
+
+    def unsubscribe(self):
+        with self._lock:
+            self.clients -= 1
+
+    def add_listener(self, fn):
+        """fn() se llama tras cada publicación (p. ej. para despertar greenlets)."""
+        self._listeners.append(fn)
+
+    def publish(self, data):
+        """Publica un frame nuevo y avisa a los listeners."""
+        with self._lock:
+            self._frame = data
+            self._seq += 1
+            self.published_at = metrics.now()
+        for fn in self._listeners:
+            fn()
+
+    def latest(self):
+        """Devuelve (seq, frame) del último frame publicado sin esperar."""
+        with self._lock:
+            return self._seq, self._frame
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        """Despierta a todos los clientes para que terminen su stream."""
+        with self._lock:
+            self._closed = True
+        for fn in self._listeners:
+            fn()
+
+
+# ------------------------------------------------------------------
+# 🎥 Pipeline de cámara
+# ------------------------------------------------------------------
+try:
+    from picamera2 import Picamera2
+    from picamera2.encoders import JpegEncoder, MJPEGEncoder
+    from picamera2.outputs import Output
+except ImportError:  # fuera de la Raspberry Pi
+    Picamera2 = None
+    JpegEncoder = MJPEGEncoder = None
+    Output = object
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def frame_view(buf):
+    """Devuelve una vista de solo lectura sobre el JPEG codificado.
+
+    Si el encoder entrega bytes inmutables no se copia nada; si entrega un
+    búfer mutable (mmap que el encoder reutiliza) se copia una sola vez.
+    """
+    view = memoryview(buf)
+    if not view.readonly:
+        view = memoryview(view.tobytes())
+    return view
+
+
+def frame_bytes(view):
+    """Convierte una vista en bytes para WSGI, sin copiar si cubre un bytes completo."""
+    obj = getattr(view, "obj", view)
+    if isinstance(obj, bytes) and view.nbytes == len(obj):
+        return obj
+    return bytes(view)
+
+
+# ------------------------------------------------------------------
+# 📸 Fotos sueltas (/snapshot.jpg)
+# ------------------------------------------------------------------
+try:
+    from PIL import Image
+except ImportError:  # sin Pillow no hay variantes reducidas
+    Image = None
+
+
+class SnapshotCache:
+    """Último frame de un difusor como JPEG suelto, con variantes por ancho.
+
+    Las variantes reducidas se calculan una vez por frame y se descartan
+    cuando llega uno nuevo; el ancho se redondea a múltiplos de `step` para
+    que anchos casi iguales compartan la misma variante.
+    """
+
+    def __init__(self, broadcaster, step=16, quality=80):
+        self.broadcaster = broadcaster
+        self.step = step
+        self.quality = quality
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._variants = {}
+
+    def width(self, width):
+        """Ancho efectivo de la variante (None = frame original)."""
+        if not width or Image is None:
+            return None
+        return max(self.step, (int(width) + self.step - 1) // self.step * self.step)
+
+    def get(self, width=None):
+        """Devuelve (seq, jpeg) del último frame, reducido a `width` si se pide."""
+        seq, frame = self.broadcaster.latest()
+        if frame is None:
+            return seq, None
+        width = self.width(width)
+        if width is None:
+            return seq, frame_bytes(frame)
+        with self._lock:
+            if seq != self._seq:
+                self._seq = seq
+                self._variants = {}
+            data = self._variants.get(width)
+            if data is None:
+                data = self._variants[width] = self._resize(frame, width)
+        return seq, data
+
+    def _resize(self, frame, width):
+        img = Image.open(io.BytesIO(frame_bytes(frame)))
+        if width >= img.width:
+            return frame_bytes(frame)
+        size = (width, max(1, img.height * width // img.width))
+        # draft() reduce el JPEG al decodificarlo (escala DCT), mucho más
+        # barato que decodificar completo y luego reducir
+        img.draft("RGB", size)
+        img = img.convert("RGB").resize(size)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=self.quality)
+        return buf.getvalue()
+
+
+class ProfileOutput(Output):
+    """Salida de Picamera2 que reparte cada frame codificado entre perfiles.
+
+    Todos los perfiles de un mismo stream comparten esta salida, así que
+    el frame se codifica una sola vez; cada perfil publica en su propio
+    difusor sólo cuando ha pasado su intervalo mínimo (tope de fps).
+    """
+
+    def __init__(self, targets, idle_fps=1.0):
+        super().__init__()
+        # [difusor, intervalo mínimo, siguiente envío]
+        self.targets = [[b, 1.0 / fps if fps else 0.0, 0.0] for b, fps in targets]
+        self.idle_interval = 1.0 / idle_fps if idle_fps else 0.0
+        self.idle = False  # escena quieta y sin clientes: publicar a idle_fps
+        # SensorTimestamp (µs) -> metrics.now() al entregarlo al encoder
+        self._arrivals = collections.OrderedDict()
+        self._first = None  # firsttimestamp del encoder (µs), calibrado al vuelo
+
+    def wrap_encoder(self, encoder):
+        """Anota cuándo cada request entra al encoder (ver _encode_delay)."""
+        encode = encoder.encode
+
+        def timed_encode(stream, request, *args, **kwargs):
+            try:
+                sensor_ns = request.get_metadata().get("SensorTimestamp")
+            except Exception:
+                sensor_ns = None
+            if sensor_ns:
+                self._arrivals[sensor_ns // 1000] = metrics.now()
+                if len(self._arrivals) > 64:
+                    self._arrivals.popitem(last=False)
+            return encode(stream, request, *args, **kwargs)
+
+        encoder.encode = timed_encode
+        self._arrivals.clear()
+        self._first = None
+
+    def _encode_delay(self, timestamp):
+        """Segundos entre la entrega al encoder y esta salida, o None.
+
+        El encoder pasa `timestamp` relativo a su primer frame
+        ((ts - firsttimestamp) // 1000), no al reloj monótono. Se calibra
+        buscando el SensorTimestamp inicial entre los recibidos; el
+        redondeo a µs permite una diferencia de 1.
+        """
+        if self._first is not None:
+            for sensor in (self._first + timestamp, self._first + timestamp + 1):
+                arrived = self._arrivals.pop(sensor, None)
+                if arrived is not None:
+                    return metrics.now() - arrived
+            self._first = None  # encoder reiniciado: recalibrar
+        if timestamp <= 0:
+            return None
+        for sensor in list(self._arrivals):
+            for first in (sensor - timestamp, sensor - timestamp - 1):
+                if first in self._arrivals:
+                    self._first = first
+                    return metrics.now() - self._arrivals.pop(sensor)
+        return None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+        start = metrics.now()
+        if timestamp is not None and self._arrivals:
+            delay = self._encode_delay(timestamp)
+            if delay is not None:
+                _encode_hist.observe(delay)
+        now = time.monotonic()
+        view = None
+        for target in self.targets:
+            broadcaster, interval, due = target
+            if self.idle:
+                interval = max(interval, self.idle_interval)
+            # Tolerancia del 10% para no perder frames por jitter del sensor
+            if now < due - interval * 0.1:
+                continue
+            if view is None:
+                view = frame_view(frame)
+            target[2] = (due if now - due < interval else now) + interval
+            broadcaster.publish(view)
+        if view is not None:
+            _publish_hist.since(start)
+
+
+class FakeCamera:
+    """Imita la parte de Picamera2 que usa el servidor, para probar sin hardware.
+
+    Genera frames JPEG (la imagen indicada o un marcador mínimo) al ritmo
+    configurado con el control FrameRate, uno por encoder activo.
+    """
+
+    def __init__(self, image=None):
+        if image:
+            with open(image, "rb") as f:
+                self._jpeg = f.read()
+        else:
+            self._jpeg = None
+        self.fps = 30.0
+        self.frame_count = 0
+        self.scene = 0  # nivel de luma del frame lores simulado
+        self._encoders = []
+        self._stop = threading.Event()
+
+    def create_video_configuration(
+        self, main=None, lores=None, controls=None, **kwargs
+    ):
+        return {"main": main or {}, "lores": lores, "controls": controls or {}}
+
+    create_preview_configuration = create_video_configuration
+
+    def configure(self, cfg):
+        self.config = cfg
+        self.fps = float(cfg.get("controls", {}).get("FrameRate", self.fps))
+
+    def start(self):
+        self._stop.clear()
+
+    def stop(self):
+        self.stop_recording()
+
+    def close(self):
+        self.stop()
+
+    def _next_jpeg(self):
+        self.frame_count += 1
+        if self._jpeg is not None:
+            return self._jpeg
+        return b"\xff\xd8" + self.frame_count.to_bytes(8, "big") + b"\xff\xd9"
+
+    def capture_file(self, f, format="jpeg"):
+        f.write(self._next_jpeg())
+
+    def capture_array(self, name="main"):
+        w, h = self.config[name]["size"]
+        return np.full((h * 3 // 2, w), self.scene, dtype=np.uint8)
+
+    def start_encoder(self, encoder, output, name="main"):
+        def loop():
+            interval = 1.0 / self.fps
+            deadline = time.monotonic()
+            while not self._stop.is_set():
+                output.outputframe(self._next_jpeg())
+                deadline += interval
+                self._stop.wait(max(0.0, deadline - time.monotonic()))
+
+        thread = threading.Thread(target=loop, daemon=True)
+        self._encoders.append(thread)
+        thread.start()
+
+    def start_recording(self, encoder, output):
+        self.start()
+        self.start_encoder(encoder, output)
+
+    def stop_recording(self):
+        self._stop.set()
+        for thread in self._encoders:
+            thread.join(timeout=1)
+        self._encoders = []
+
+
+class MotionDetector:
+    """Detecta movimiento comparando la luma reducida de frames lores.
+
+    Toma el plano Y de un frame YUV420, lo reduce tomando un píxel de cada
+    `downscale` y cuenta la fracción de píxeles que cambiaron más de
+    `pixel_threshold` niveles respecto al frame anterior.
+    """
+
+    def __init__(self, pixel_threshold=25, threshold=0.02, downscale=4):
+        self.pixel_threshold = pixel_threshold
+        self.threshold = threshold
+        self.downscale = downscale
+        self._prev = None
+
+    def update(self, yuv, height):
+        """Procesa un frame lores; devuelve (hay_movimiento, score)."""
+        k = self.downscale
+        luma = yuv[:height:k, ::k].astype(np.int16)
+        prev, self._prev = self._prev, luma
+        if prev is None or prev.shape != luma.shape:
+            return False, 0.0
+        changed = np.count_nonzero(np.abs(luma - prev) > self.pixel_threshold)
+        score = changed / luma.size
+        return score > self.threshold, score
+
+
+def open_camera(cam_cfg):
+    """Crea la cámara según camera.backend ("picamera2" o "fake")."""
+    if cam_cfg.get("backend", "picamera2") == "fake":
+        return FakeCamera(cam_cfg.get("fake_image"))
+    if Picamera2 is None:
+        raise RuntimeError("picamera2 no está instalado")
+    return Picamera2()
+
+
+class CameraPipeline:
+    """Captura y codifica cada frame una sola vez y lo publica por perfil.
+
+    Los perfiles (thumb, std, hd...) se definen en camera.profiles con el
+    stream de Picamera2 del que salen ("main" o "lores") y su tope de fps.
+    Cada stream usado tiene un solo encoder sin importar cuántos perfiles
+    o clientes lo consuman.
+
+    Modo "encoder": el encoder de Picamera2 (MJPEG por hardware o JPEG)
+    entrega los frames ya codificados y el sensor marca el ritmo con
+    FrameRate. Modo "capture": el ciclo clásico con capture_file, para
+    cámaras sin encoder; todos los perfiles salen del stream main.
+    """
+
+    def __init__(self, picam2, cam_cfg, on_motion=None):
+        self.picam2 = picam2
+        self.on_motion = on_motion
+        self.motion = False
+        self._active_until = 0.0
+        self._idle = False
+        self._encoders = []
+        self._outputs_by_stream = {}
+        self.profiles = cam_cfg.get("profiles") or {"std": {"stream": "main"}}
+        self.broadcasters = {name: FrameBroadcaster() for name in self.profiles}
+        self.configure(cam_cfg)
+        self._running = False
+        self._thread = None
+        self._motion_thread = None
+
+    def configure(self, cam_cfg):
+        """Aplica una configuración nueva (con la cámara detenida).
+
+        Los difusores se conservan: un perfil nuevo o eliminado necesita
+        reiniciar el servidor, el resto (fps, stream) se aplica al arrancar.
+        """
+        self.cfg = cam_cfg
+        self.motion_cfg = cam_cfg.get("motion", {})
+        self.motion_enabled = self.motion_cfg.get("enabled", False) and np is not None
+        self.mode = cam_cfg.get("pipeline", "encoder")
+        profiles = cam_cfg.get("profiles") or {"std": {"stream": "main"}}
+        if set(profiles) != set(self.broadcasters):
+            logger.warning(
+                "⚠️ Cambiar la lista de perfiles requiere reiniciar el servidor"
+            )
+        self.profiles = {
+            name: profiles.get(name, self.profiles[name]) for name in self.broadcasters
+        }
+        self.default_profile = cam_cfg.get("default_profile", "std")
+        if self.default_profile not in self.profiles:
+            self.default_profile = next(iter(self.profiles))
+
+    def broadcaster(self, profile=None):
+        """Difusor del perfil indicado (o del perfil por defecto)."""
+        return self.broadcasters[profile or self.default_profile]
+
+    def active(self):
+        """True si hay clientes viendo o hubo movimiento reciente."""
+        if not self.motion_enabled:
+            return True
+        if any(b.clients for b in self.broadcasters.values()):
+            return True
+        return time.monotonic() < self._active_until
+
+    def _outputs(self, capture=False):
+        """Agrupa los perfiles por stream: {stream: (ProfileOutput, fps máx)}."""
+        groups = {}
+        for name, profile in self.profiles.items():
+            stream = "main" if capture else profile.get("stream", "main")
+            groups.setdefault(stream, []).append(
+                (self.broadcasters[name], profile.get("fps"))
+            )
+        idle_fps = self.motion_cfg.get("idle_fps", 1.0)
+        return {
+            stream: (
+                ProfileOutput(targets, idle_fps),
+                max(fps or 0 for _, fps in targets),
+            )
+            for stream, targets in groups.items()
+        }
+
+    def _create_encoder(self):
+        if isinstance(self.picam2, FakeCamera):
+            return None
+        if self.cfg.get("encoder", "mjpeg") == "jpeg":
+            return JpegEncoder()
+        return MJPEGEncoder()
+
+    def start(self):
+        fps = float(self.cfg.get("fps", 30))
+        capture = self.mode != "encoder"
+        outputs = self._outputs(capture)
+        create = (
+            self.picam2.create_preview_configuration
+            if capture
+            else self.picam2.create_video_configuration
+        )
+        streams = {
+            "main": {
+                "size": tuple(self.cfg["resolution"]),
+                "format": self.cfg["format"],
+            },
+            "controls": {"FrameRate": fps},
+        }
+        if "lores" in outputs or self.motion_enabled:
+            streams["lores"] = {
+                "size": tuple(self.cfg["lores_resolution"]),
+                "format": "YUV420",
+            }
+        self.picam2.configure(create(**streams))
+        self._outputs_by_stream = {k: out for k, (out, _) in outputs.items()}
+        self._encoders = []
+        self._idle = False
+        self._running = True
+        self.picam2.start()
+        if self.motion_enabled:
+            self._motion_thread = threading.Thread(
+                target=self._motion_loop, daemon=True
+            )
+            self._motion_thread.start()
+        if capture:
+            self._thread = threading.Thread(
+                target=self._capture_loop, args=(outputs["main"][0],), daemon=True
+            )
+            self._thread.start()
+            return
+        for stream, (output, max_fps) in outputs.items():
+            encoder = self._create_encoder()
+            # Saltar frames en el encoder si ningún perfil necesita el fps completo
+            skip = max(1, int(fps // max_fps)) if max_fps else 1
+            if hasattr(encoder, "frame_skip_count"):
+                encoder.frame_skip_count = skip
+                self._encoders.append((encoder, skip))
+            output.wrap_encoder(encoder)
+            self.picam2.start_encoder(encoder, output, name=stream)
+
+    def _set_idle(self, idle):
+        """Baja (o restaura) el ritmo de publicación y de codificación."""
+        if idle == self._idle:
+            return
+        self._idle = idle
+        for output in self._outputs_by_stream.values():
+            output.idle = idle
+        idle_fps = self.motion_cfg.get("idle_fps", 1.0)
+        idle_skip = max(1, int(float(self.cfg.get("fps", 30)) // idle_fps))
+        for encoder, skip in self._encoders:
+            encoder.frame_skip_count = idle_skip if idle else skip
+        logger.info(f"🎥 Cámara {'en reposo' if idle else 'activa'}")
+
+    def _motion_loop(self):
+        detector = MotionDetector(
+            self.motion_cfg.get("pixel_threshold", 25),
+            self.motion_cfg.get("threshold", 0.02),
+            self.motion_cfg.get("downscale", 4),
+        )
+        height = self.cfg["lores_resolution"][1]
+        interval = self.motion_cfg.get("interval", 0.2)
+        hold = self.motion_cfg.get("hold", 10.0)
+        while self._running:
+            try:
+                moving, score = detector.update(
+                    self.picam2.capture_array("lores"), height
+                )
+                if moving:
+                    self._active_until = time.monotonic() + hold
+                # El movimiento termina cuando pasan `hold` segundos sin cambios
+                motion = time.monotonic() < self._active_until
+                if motion != self.motion:
+                    self.motion = motion
+                    if self.on_motion:
+                        self.on_motion({"motion": motion, "score": round(score, 4)})
+                self._set_idle(not self.active())
+            except Exception as e:
+                logger.warning(f"⚠️ Error en detección de movimiento: {e}")
+                time.sleep(1)
+            time.sleep(interval)
+
+    def _capture_loop(self, output):
+        # Un cambio de configuración reinicia el pipeline, así que basta leerlo una vez
+        frame_interval = self.cfg["frame_interval"]
+        while self._running:
+            try:
+                buf = io.BytesIO()
+                start = metrics.now()
+                # capture_file captura y codifica a JPEG en software
+                self.picam2.capture_file(buf, format="jpeg")
+                _capture_hist.since(start)
+                output.outputframe(buf.getvalue())
+                if self._idle:
+                    time.sleep(output.idle_interval)
+                else:
+                    time.sleep(frame_interval)
+            except Exception as e:
+                logger.warning(f"⚠️ Error en captura: {e}")
+                time.sleep(1)
+
+    def stop(self):
+        self._running = False
+        if self._motion_thread is not None:
+            self._motion_thread.join(timeout=2)
+            self._motion_thread = None
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+            self.picam2.stop()
+        else:
+            self.picam2.stop_recording()
+
+    def close(self):
+        """Despierta a todos los clientes para que terminen su stream."""
+        for broadcaster in self.broadcasters.values():
+            broadcaster.close()
+
+
+# ------------------------------------------------------------------
+# 🔌 Arranque bajo demanda
+# ------------------------------------------------------------------
+class CameraManager:
+    """Enciende la cámara con el primer consumidor y la apaga sin consumidores.
+
+    Los consumidores (clientes de /video_feed, snapshots...) llaman a
+    acquire()/release(). Cuando el contador llega a
+    cero la cámara se detiene tras `idle_timeout` segundos de gracia.
+    Los difusores del pipeline se conservan entre ciclos, así que los
+    clientes no notan el reinicio. Si el arranque falla se cierra la
+    cámara para reabrirla limpia en el siguiente intento.
+    """
+
+    def __init__(self, cam_cfg, on_motion=None):
+        self.cfg = cam_cfg
+        self.idle_timeout = cam_cfg.get("idle_timeout", 30.0)
+        self.pipeline = CameraPipeline(None, cam_cfg, on_motion)
+        self._lock = threading.Lock()
+        self._refs = 0
+        self._timer = None
+        self.running = False
+
+    def _start(self):
+        if not self.cfg.get("enabled", True):
+            raise RuntimeError("cámara deshabilitada (camera.enabled)")
+        if self.pipeline.picam2 is None:
+            self.pipeline.picam2 = open_camera(self.cfg)
+        try:
+            self.pipeline.start()
+        except Exception:
+            # stop() baja _running y espera los hilos ya lanzados (movimiento,
+            # captura) antes de cerrar; si no, quedan huérfanos y cada
+            # reintento agrega otro
+            try:
+                self.pipeline.stop()
+            except Exception:
+                pass
+            self._close_camera()
+            raise
+        self.running = True
+        logger.info(f"✅ Cámara iniciada (pipeline: {self.pipeline.mode})")
+
+    def _stop(self):
+        try:
+            self.pipeline.stop()
+        except Exception as e:
+            logger.warning(f"⚠️ Error deteniendo cámara: {e}")
+            self._close_camera()
+        self.running = False
+        logger.info("💤 Cámara detenida (sin consumidores)")
+
+    def _close_camera(self):
+        try:
+            self.pipeline.picam2.close()
+        except Exception:
+            pass
+        self.pipeline.picam2 = None
+
+    def acquire(self):
+        """Registra un consumidor y arranca la cámara si estaba apagada."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.running:
+                self._start()
+            self._refs += 1
+
+    def release(self):
+        """Libera un consumidor; programa el apagado si era el último."""
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0 or not self.running:
+                return
+            self._timer = threading.Timer(self.idle_timeout, self._stop_if_idle)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _stop_if_idle(self):
+        with self._lock:
+            self._timer = None
+            if self._refs == 0 and self.running:
+                self._stop()
+
+    def reconfigure(self, cam_cfg):
+        """Aplica la configuración nueva; si la cámara estaba encendida la
+        reinicia (los clientes conservan su difusor y sólo notan una pausa)."""
+        with self._lock:
+            restart = self.running
+            if restart:
+                self._stop()
+            reopen = cam_cfg.get("backend") != self.cfg.get("backend")
+            self.cfg = cam_cfg
+            self.idle_timeout = cam_cfg.get("idle_timeout", 30.0)
+            self.pipeline.configure(cam_cfg)
+            if reopen and self.pipeline.picam2 is not None:
+                self._close_camera()
+            if restart:
+                try:
+                    self._start()
+                except Exception as e:
+                    logger.error(f"🚫 No se pudo reiniciar la cámara: {e}")
+
+    def shutdown(self):
+        """Apaga la cámara y despierta a los clientes (fin del servidor)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.pipeline.close()
+            if self.running:
+                self._stop()
+            if self.pipeline.picam2 is not None:
+                self._close_camera()
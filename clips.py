@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------
+# 🎞️ Últimos segundos de video
+# ------------------------------------------------------------------
+class FrameRing:
+    """Buffer circular con los últimos frames codificados de un perfil.
+
+    Guarda (momento, frame) sin copiar el JPEG; el tamaño es fijo
+    (`seconds` x `fps` frames), así la memoria no crece con el tiempo.
+    """
+
+    def __init__(self, seconds=5.0, fps=10):
+        self._frames = collections.deque(maxlen=max(1, int(seconds * fps)))
+        self._lock = threading.Lock()
+        self._last_seq = 0
+        self.broadcaster = None
+
+    def attach(self, broadcaster):
+        """Se alimenta de cada frame que publique el difusor."""
+        self.broadcaster = broadcaster
+
+        def on_frame():
+            seq, frame = broadcaster.latest()
+            if frame is None or seq == self._last_seq:
+                return
+            self._last_seq = seq
+            with self._lock:
+                self._frames.append((time.monotonic(), frame))
+
+        broadcaster.add_listener(on_frame)
+
+    def window(self, start, end):
+        """Frames con momento entre start y end (time.monotonic())."""
+        with self._lock:
+            return [f for t, f in self._frames if start <= t <= end]
+
+
+# ------------------------------------------------------------------
+# 💾 Clips por evento
+# ------------------------------------------------------------------
+class ClipRecorder:
+    """Guarda un clip MJPEG (JPEGs concatenados) alrededor de cada evento.
+
+    trigger() regresa de inmediato con el nombre del clip; un hilo corto
+    mantiene la cámara encendida `post` segundos (contando como cliente
+    del perfil para que no baje a idle_fps), toma del buffer los
+    frames entre `pre` segundos antes y `post` después del evento y los
+    escribe a disco. Si el directorio supera `quota_mb` se borran los
+    clips más viejos.
+    """
+
+    def __init__(
+        self, ring, directory, pre=3.0, post=3.0, quota_mb=500, camera_manager=None
+    ):
+        self.ring = ring
+        # Absoluta: send_file resuelve rutas relativas contra app.root_path,
+        # no contra el directorio de trabajo donde se escribió el clip
+        self.directory = os.path.abspath(directory)
+        self.pre = pre
+        self.post = post
+        self.quota = int(quota_mb * 1024 * 1024)
+        self.camera_manager = camera_manager
+        self._quota_lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def trigger(self, tipo):
+        """Programa el clip del evento `tipo`; devuelve el nombre del archivo.
+
+        El archivo aparece `post` segundos después y puede no llegar a
+        existir (sin frames o error de disco) o borrarse por cuota."""
+        now = time.monotonic()
+        ms = int(now * 1000) % 1000
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{ms:03d}-{tipo}.mjpeg"
+        threading.Thread(target=self._record, args=(name, now), daemon=True).start()
+        return name
+
+    def _record(self, name, moment):
+        acquired = False
+        if self.camera_manager is not None:
+            try:
+                self.camera_manager.acquire()
+                acquired = True
+            except Exception as e:
+                logger.warning(f"⚠️ Clip {name} sin cámara: {e}")
+        broadcaster = self.ring.broadcaster
+        if broadcaster is not None:
+            broadcaster.subscribe()
+        try:
+            time.sleep(max(0.0, moment + self.post - time.monotonic()))
+        finally:
+            if broadcaster is not None:
+                broadcaster.unsubscribe()
+            if acquired:
+                self.camera_manager.release()
+
+        frames = self.ring.window(moment - self.pre, moment + self.post)
+        if not frames:
+            logger.warning(f"⚠️ Clip {name} sin frames")
+            return
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                for frame in frames:
+                    f.write(frame)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error(f"⚠️ No se pudo guardar el clip {name}: {e}")
+            return
+        logger.info(f"🎞️ Clip guardado: {name} ({len(frames)} frames)")
+        self._enforce_quota()
+
+    def _enforce_quota(self):
+        with self._quota_lock:
+            clips = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".mjpeg"):
+                    st = entry.stat()
+                    clips.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in clips)
+            # El clip más nuevo se conserva aunque solo exceda la cuota
+            for _, size, path in sorted(clips)[:-1]:
+                if total <= self.quota:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    logger.info(
+                        f"🧹 Clip eliminado por cuota: {os.path.basename(path)}"
+                    )
+                except OSError:
+                    pass
+
+    def path(self, name):
+        """Ruta del clip o None si el nombre no es válido o ya no existe."""
+        if os.path.basename(name) != name or not name.endswith(".mjpeg"):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
@@ -1,14 +1,96 @@
 import sqlite3
-import logging, bcrypt, json, os
+import logging, bcrypt, json, threading, queue, contextlib, time, base64
+import itertools, tempfile
+from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger(__name__)
 
 DB_PATH = "/home/bytheg/vport/vport.db"
-CONFIG_FILE = "config.json"
+
+POOL_SIZE = 4  # conexiones abiertas que se conservan para reutilizar
+BUSY_TIMEOUT = 5.0  # segundos que una escritura espera un bloqueo antes de fallar
+CACHED_STATEMENTS = 128  # sentencias preparadas en caché por conexión
+
+
+# --- Pool de conexiones ---
+class ConnectionPool:
+    """Conexiones SQLite reutilizables, en modo WAL.
+
+    Cada conexión la usa un solo hilo a la vez: connection() la presta y
+    la devuelve al terminar. Con WAL las lecturas (búsqueda NFC) no se
+    bloquean mientras el panel escribe.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # INSERT OR REPLACE debe disparar el trigger de borrado del índice FTS
+        conn.execute("PRAGMA recursive_triggers=ON")
+        conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection():
+    """Presta una conexión del pool: `with db.connection() as conn:`"""
+    global _pool
+    if _pool is None or _pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool.connection()
+
+
+def close_pool():
+    """Cierra las conexiones del pool (al detener el servidor)"""
+    if _pool is not None:
+        _pool.close()
 
 
 # --- Inicialización DB ---
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    with connection() as conn:
+        _create_tables(conn)
+
+
+def _create_tables(conn):
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS usuarios (
@@ -34,22 +116,159 @@ def init_db():
            	PRIMARY KEY("id")
         )
         """)
+    # Paginación por cursor (fecha, id); las filas sin fecha no tendrían cursor
+    c.execute("UPDATE usuarios SET fecha = CURRENT_TIMESTAMP WHERE fecha IS NULL")
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usuarios_fecha_id
+        ON usuarios (fecha DESC, id DESC)
+        """)
+    _create_fts(c)
+    _create_accesos(c)
     conn.commit()
-    conn.close()
+
+
+def _create_fts(c):
+    """Índice de texto completo sobre usuarios, sincronizado con triggers"""
+    global FTS_ENABLED
+    existe = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'usuarios_fts'"
+    ).fetchone()
+    try:
+        c.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS usuarios_fts USING fts5(
+                id, nombre, ap, am, email,
+                content='usuarios', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """)
+    except sqlite3.OperationalError as e:
+        logging.warning(f"⚠️ SQLite sin FTS5, la búsqueda usará LIKE: {e}")
+        FTS_ENABLED = False
+        return
+    c.executescript("""
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_ai AFTER INSERT ON usuarios BEGIN
+            INSERT INTO usuarios_fts (rowid, id, nombre, ap, am, email)
+            VALUES (new.rowid, new.id, new.nombre, new.ap, new.am, new.email);
+        END;
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_ad AFTER DELETE ON usuarios BEGIN
+            INSERT INTO usuarios_fts (usuarios_fts, rowid, id, nombre, ap, am, email)
+            VALUES ('delete', old.rowid, old.id, old.nombre, old.ap, old.am, old.email);
+        END;
+        CREATE TRIGGER IF NOT EXISTS usuarios_fts_au AFTER UPDATE ON usuarios BEGIN
+            INSERT INTO usuarios_fts (usuarios_fts, rowid, id, nombre, ap, am, email)
+            VALUES ('delete', old.rowid, old.id, old.nombre, old.ap, old.am, old.email);
+            INSERT INTO usuarios_fts (rowid, id, nombre, ap, am, email)
+            VALUES (new.rowid, new.id, new.nombre, new.ap, new.am, new.email);
+        END;
+        """)
+    if not existe:
+        c.execute("INSERT INTO usuarios_fts (usuarios_fts) VALUES ('rebuild')")
+    FTS_ENABLED = True
+
+
+def _create_accesos(c):
+    """Bitácora de accesos y su resumen por hora"""
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS accesos (
+            "id"	INTEGER,
+            "fecha"	DATETIME NOT NULL,
+            "tipo"	TEXT NOT NULL,
+            "usuarioId"	TEXT,
+            "autorizado"	INTEGER,
+            "detalle"	TEXT,
+            "clip"	TEXT,
+            PRIMARY KEY("id")
+        )
+        """)
+    # Bitácoras creadas antes de los clips por evento
+    columnas = [r[1] for r in c.execute("PRAGMA table_info(accesos)")]
+    if "clip" not in columnas:
+        c.execute("ALTER TABLE accesos ADD COLUMN clip TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_accesos_fecha ON accesos (fecha)")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_accesos_usuario ON accesos (usuarioId, id)"
+    )
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS accesos_hora (
+            "hora"	TEXT NOT NULL,
+            "tipo"	TEXT NOT NULL,
+            "autorizado"	INTEGER NOT NULL,
+            "total"	INTEGER NOT NULL,
+            PRIMARY KEY("hora", "tipo", "autorizado")
+        )
+        """)
+
+
+# --- Contraseñas (bcrypt en un pool acotado) ---
+# bcrypt suelta el GIL mientras calcula, así que un par de hilos basta para
+# que un hash lento no congele el stream ni los eventos de los demás hilos.
+BCRYPT_ROUNDS = 12
+HASH_WORKERS = 2
+HASH_QUEUE = 8  # trabajos en espera antes de rechazar con HashPoolBusy
+
+_hash_pool = None
+_hash_slots = None
+_hash_executor = ThreadPoolExecutor  # en modo gevent, uno cuyo result() coopera
+
+
+class HashPoolBusy(Exception):
+    """El pool de bcrypt está lleno; el llamador debe reintentar más tarde"""
+
+
+def configure_hashing(rounds=None, workers=None, max_queue=None, executor=None):
+    """Ajusta costo de bcrypt y tamaño del pool (desde config["security"])"""
+    global BCRYPT_ROUNDS, HASH_WORKERS, HASH_QUEUE, _hash_pool, _hash_executor
+    BCRYPT_ROUNDS = rounds or BCRYPT_ROUNDS
+    HASH_WORKERS = workers or HASH_WORKERS
+    HASH_QUEUE = max_queue if max_queue is not None else HASH_QUEUE
+    _hash_executor = executor or _hash_executor
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False)
+        _hash_pool = None
+
+
+def _run_hash(fn, *args):
+    """Ejecuta fn en el pool de bcrypt y espera el resultado"""
+    global _hash_pool, _hash_slots
+    if _hash_pool is None:
+        _hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE)
+        _hash_pool = _hash_executor(HASH_WORKERS, thread_name_prefix="bcrypt")
+    slots = _hash_slots
+    if not slots.acquire(blocking=False):
+        raise HashPoolBusy("Demasiadas operaciones de contraseña en espera")
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda f: slots.release())
+    return future.result()
+
+
+def _hashpw(password, rounds):
+    salt = bcrypt.gensalt(rounds=rounds)
+    return bcrypt.hashpw(password.encode("utf-8"), salt).decode("utf-8")
+
+
+def _checkpw(password, password_hash):
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
 
 
 def hash_password(password):
-    """Encriptar contraseña"""
-    # Generar salt y hash la contraseña
-    salt = bcrypt.gensalt()
-    password_hash = bcrypt.hashpw(password.encode("utf-8"), salt)
-    return password_hash.decode("utf-8")
+    """Encriptar contraseña; sin contraseña (sólo tarjeta) no se calcula hash"""
+    if not password:
+        return ""
+    return _run_hash(_hashpw, password, BCRYPT_ROUNDS)
 
 
 def verify_password(password, password_hash):
     """Verificar contraseña encriptada"""
+    if not password or not password_hash:
+        return False
     try:
-        return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+        return _run_hash(_checkpw, password, password_hash)
+    except HashPoolBusy:
+        raise
     except Exception as e:
         logger.error(f"Error al verificar contraseña: {e}")
         return False
@@ -58,24 +277,22 @@ def verify_password(password, password_hash):
 def verificar_usuario(username, password):
     """Verificar credenciales de usuario"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute(
-            """
-            SELECT usr.*, tu.tipo
-            FROM usuarios AS usr
-            INNER JOIN tipoUsuario AS tu ON usr.tipoId = tu.id
-            WHERE usr.nombre = ?""",
-            (username,),
-        )
-        usuario = c.fetchone()
-        conn.close()
+        with connection() as conn:
+            usuario = conn.execute(
+                """
+                SELECT usr.*, tu.tipo
+                FROM usuarios AS usr
+                INNER JOIN tipoUsuario AS tu ON usr.tipoId = tu.id
+                WHERE usr.nombre = ?""",
+                (username,),
+            ).fetchone()
 
         if usuario and verify_password(password, usuario["pwd"]):
             return usuario
         return None
 
+    except HashPoolBusy:
+        raise
     except Exception as e:
         logger.error(f"Error al verificar usuario: {e}")
         return None
@@ -87,128 +304,560 @@ def add_usuario(
 ):
     try:
         pwd_hash = hash_password(pwd)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            """
-            INSERT OR REPLACE INTO usuarios (id, nombre, ap, am, pwd, email,
-            cell, tipoId, activo, operador) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (id, nombre, ap, am, pwd_hash, email, cell, tipoId, activo, operador),
-        )
-        conn.commit()
-        user_id = c.lastrowid
-        conn.close()
+        with connection() as conn:
+            # Editar desde el panel sin escribir contraseña conserva la actual
+            # (el listado ya no envía el hash al formulario)
+            c = conn.execute(
+                """
+                INSERT INTO usuarios (id, nombre, ap, am, pwd, email,
+                cell, tipoId, activo, operador) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET nombre = excluded.nombre,
+                ap = excluded.ap, am = excluded.am,
+                pwd = CASE WHEN excluded.pwd = '' THEN pwd ELSE excluded.pwd END,
+                email = excluded.email, cell = excluded.cell,
+                tipoId = excluded.tipoId, activo = excluded.activo,
+                operador = excluded.operador""",
+                (id, nombre, ap, am, pwd_hash, email, cell, tipoId, activo, operador),
+            )
+            conn.commit()
+            user_id = c.lastrowid
+        _patch_auth(id, (bool(activo), nombre, tipoId))
+        _count_cache.clear()
         logging.info(f"🆕 Usuario agregado: {id}, {nombre}")
 
         return user_id
     except sqlite3.IntegrityError:
         raise ValueError("El usuario ya existe")
+    except HashPoolBusy:
+        raise
     except Exception as e:
         logger.error(f"Error al crear usuario: {e}")
         raise
 
 
 def update_usuario(id, nombre, tipoId, activo):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "UPDATE usuarios SET nombre=?, tipoId=?, activo=? WHERE id=?",
-        (nombre, tipoId, activo, id),
-    )
-    conn.commit()
-    conn.close()
+    """Actualiza un usuario existente; devuelve False si el id no existe."""
+    with connection() as conn:
+        c = conn.execute(
+            "UPDATE usuarios SET nombre=?, tipoId=?, activo=? WHERE id=?",
+            (nombre, tipoId, activo, id),
+        )
+        conn.commit()
+    # Sin fila no hay tarjeta: la caché no debe inventarla
+    if c.rowcount == 0:
+        return False
+    _patch_auth(id, (bool(activo), nombre, tipoId))
+    return True
 
 
 def remove_usuario(id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM usuarios WHERE id=?", (id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        conn.execute("DELETE FROM usuarios WHERE id=?", (id,))
+        conn.commit()
+    _patch_auth(id, None)
+    _count_cache.clear()
 
 
 def list_usuarios():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
+    with connection() as conn:
+        return conn.execute("""
                 SELECT usr.*, tu.tipo FROM usuarios AS usr
                 INNER JOIN tipoUsuario AS tu
                 ON usr.tipoId = tu.id
-                """)
-    usuarios = c.fetchall()
-    conn.close()
-    return usuarios
+                """).fetchall()
+
+
+# --- Importación / exportación masiva ---
+CAMPOS_USUARIO = (
+    "id",
+    "nombre",
+    "ap",
+    "am",
+    "pwd",
+    "email",
+    "cell",
+    "tipoId",
+    "activo",
+    "operador",
+)
+IMPORT_BATCH = 500  # filas por executemany
+
+
+def _entero(valor, defecto):
+    return defecto if valor in (None, "") else int(valor)
+
+
+def _fila_importacion(usuario):
+    """Normaliza un dict de importación a la tupla de CAMPOS_USUARIO"""
+    id = str(usuario.get("id") or "").strip().upper()
+    if not id:
+        raise ValueError("Fila sin id")
+    pwd = usuario.get("pwd") or None  # sin pwd se conserva la actual
+    # Sólo hashes bcrypt ya hechos (p. ej. de una exportación con ?pwd=1):
+    # hashear aquí retendría el candado de escritura durante cada bcrypt
+    if pwd and not pwd.startswith("$2"):
+        raise ValueError(
+            "pwd debe ser un hash bcrypt; asigna contraseñas desde el panel"
+        )
+    return (
+        id,
+        usuario.get("nombre") or "",
+        usuario.get("ap") or "",
+        usuario.get("am") or "",
+        pwd,
+        usuario.get("email") or "",
+        usuario.get("cell") or "",
+        _entero(usuario.get("tipoId"), 2),
+        _entero(usuario.get("activo"), 1),
+        _entero(usuario.get("operador"), 0),
+    )
+
+
+def import_usuarios(usuarios):
+    """Inserta (o actualiza) usuarios desde un iterable de dicts.
+
+    Primero se validan todas las filas y se guardan normalizadas en un
+    archivo temporal: el iterable puede venir de una subida lenta y no se
+    debe retener el candado de escritura mientras llega. Después se
+    escriben en lotes de IMPORT_BATCH con executemany dentro de una sola
+    transacción: o entra todo el archivo o no entra nada.
+    Una fila sin pwd (la exportación la omite por defecto) conserva la
+    contraseña que ya tenía el usuario.
+    Devuelve el número de filas importadas.
+    """
+    actualizar = ", ".join(
+        f"{c} = COALESCE(excluded.{c}, {c})" if c == "pwd" else f"{c} = excluded.{c}"
+        for c in CAMPOS_USUARIO
+        if c != "id"
+    )
+    sql = f"""
+        INSERT INTO usuarios ({", ".join(CAMPOS_USUARIO)})
+        VALUES ({", ".join("?" * len(CAMPOS_USUARIO))})
+        ON CONFLICT (id) DO UPDATE SET {actualizar}"""
+    total = 0
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+        for n, usuario in enumerate(usuarios, 1):
+            try:
+                fila = _fila_importacion(usuario)
+            except (ValueError, TypeError, AttributeError) as e:
+                raise ValueError(f"Fila {n}: {e}")
+            spool.write(json.dumps(fila) + "\n")
+        spool.seek(0)
+
+        with connection() as conn:
+            try:
+                conn.execute("BEGIN")
+                while True:
+                    lote = [
+                        json.loads(linea)
+                        for linea in itertools.islice(spool, IMPORT_BATCH)
+                    ]
+                    if not lote:
+                        break
+                    conn.executemany(sql, lote)
+                    total += len(lote)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    # Muchas filas: más barato recargar la caché que parcharla una por una
+    load_auth_cache()
+    _count_cache.clear()
+    logging.info(f"📥 Importación: {total} usuarios")
+    return total
+
+
+def export_usuarios(campos=CAMPOS_USUARIO, lote=IMPORT_BATCH):
+    """Genera las filas de usuarios (`campos`, de CAMPOS_USUARIO) sin cargarlas todas"""
+    campos = [c for c in campos if c in CAMPOS_USUARIO]
+    with connection() as conn:
+        cur = conn.execute(f"SELECT {', '.join(campos)} FROM usuarios ORDER BY id")
+        while True:
+            filas = cur.fetchmany(lote)
+            if not filas:
+                return
+            yield from filas
+
+
+# --- Paginado y búsqueda ---
+FTS_ENABLED = True
+COUNT_TTL = 30.0  # segundos que se reutiliza un conteo
+_count_cache = {}  # busqueda -> (total, momento)
+
+# Sin pwd: el listado lo ven clientes web, los hashes no salen de la DB
+_QUERY_USUARIOS = """
+    SELECT u.id, u.nombre, u.ap, u.am, u.email, u.cell, u.tipoId, u.fecha,
+        u.activo, u.Operador AS operador, t.tipo
+    FROM usuarios u
+    LEFT JOIN tipoUsuario t ON u.tipoId = t.id
+"""
+
+
+def encode_cursor(row):
+    """Cursor opaco con la posición (fecha, id) de una fila"""
+    raw = json.dumps([row["fecha"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    fecha, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return fecha, id
+
+
+def _fts_query(busqueda):
+    """Convierte el texto del buscador en una consulta FTS5 por prefijos"""
+    palabras = busqueda.split()
+    return " ".join('"' + p.replace('"', '""') + '"*' for p in palabras)
+
+
+def _filtro_busqueda(busqueda):
+    if FTS_ENABLED:
+        return (
+            "u.rowid IN (SELECT rowid FROM usuarios_fts WHERE usuarios_fts MATCH ?)",
+            [_fts_query(busqueda)],
+        )
+    like = f"%{busqueda}%"
+    return (
+        "(u.nombre LIKE ? OR u.ap LIKE ? OR u.email LIKE ? OR u.id LIKE ?)",
+        [like, like, like, like],
+    )
+
+
+def buscar_usuarios(busqueda="", limite=50, cursor=None):
+    """Página de usuarios, más recientes primero, paginada por cursor.
+
+    Devuelve (usuarios, siguiente_cursor); siguiente_cursor es None en la
+    última página.
+    """
+    condiciones = []
+    params = []
+    if busqueda.strip():
+        condicion, valores = _filtro_busqueda(busqueda)
+        condiciones.append(condicion)
+        params.extend(valores)
+    if cursor:
+        condiciones.append("(u.fecha, u.id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    query = _QUERY_USUARIOS
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    query += " ORDER BY u.fecha DESC, u.id DESC LIMIT ?"
+    params.append(limite + 1)
+
+    with connection() as conn:
+        usuarios = conn.execute(query, params).fetchall()
+
+    siguiente = None
+    if len(usuarios) > limite:
+        usuarios = usuarios[:limite]
+        siguiente = encode_cursor(usuarios[-1])
+    return usuarios, siguiente
+
+
+def contar_usuarios(busqueda=""):
+    """Total de usuarios (o de coincidencias); se guarda COUNT_TTL segundos"""
+    busqueda = busqueda.strip()
+    cached = _count_cache.get(busqueda)
+    if cached and time.monotonic() - cached[1] < COUNT_TTL:
+        return cached[0]
+
+    if not busqueda:
+        query, params = "SELECT COUNT(*) FROM usuarios", []
+    elif FTS_ENABLED:
+        query = "SELECT COUNT(*) FROM usuarios_fts WHERE usuarios_fts MATCH ?"
+        params = [_fts_query(busqueda)]
+    else:
+        condicion, params = _filtro_busqueda(busqueda)
+        query = f"SELECT COUNT(*) FROM usuarios u WHERE {condicion}"
+
+    with connection() as conn:
+        total = conn.execute(query, params).fetchone()[0]
+    if len(_count_cache) > 256:
+        _count_cache.clear()
+    _count_cache[busqueda] = (total, time.monotonic())
+    return total
 
 
 def tabla_tipoUsuario():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT * FROM tipoUsuario")
-        tipoUsuario = c.fetchall()
-        conn.close()
-        return tipoUsuario
+        with connection() as conn:
+            return conn.execute("SELECT * FROM tipoUsuario").fetchall()
 
     except Exception as e:
         logging.error(f"⚠️ Error en tabla_tipoUsuarios: {e}")
 
 
+def get_usuario(id):
+    """Fila completa del usuario o None"""
+    with connection() as conn:
+        return conn.execute("SELECT * FROM usuarios WHERE id=?", (id,)).fetchone()
+
+
 def usuario_byId(id):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM usuarios WHERE id=?", (id,))
-    row = c.fetchone()
-    conn.close()
+    row = get_usuario(id)
     return row is not None and row[0] == 1
 
 
 def is_usuario_activo(id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT activo FROM usuarios WHERE id=?", (id,))
-    row = c.fetchone()
-    conn.close()
-    print(f"row : {row} | row[0]: {row[0]}")
+    with connection() as conn:
+        row = conn.execute("SELECT activo FROM usuarios WHERE id=?", (id,)).fetchone()
     return row is not None and row[0] == 1
 
 
-# ==========  Configuracion ============================
-
-
-def load_config():
-    """Cargar configuración desde el archivo JSON"""
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
-    return {}
-
-
-def save_config(config_dict):
-    """Guardar configuración en el archivo JSON"""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config_dict, f, indent=4)
-
-
-def verificarUsuarioCfg(username, pwd):
-    try:
-        # Leer el archivo JSON existente
-        with open("config.json", "r", encoding="utf-8") as f:
-            datos = json.load(f)
-
-        if datos["admin"]["username"] == username and datos["admin"]["password"] == pwd:
-            return {
-                "id": datos["admin"]["username"],
-                "nombre": datos["admin"]["username"],
-                "tipo": datos["admin"]["username"],
-            }
+# ==========  Caché de autorización (tarjetas NFC) ============================
+# id -> (activo, nombre, tipoId). Se carga una vez y las funciones CRUD de
+# este módulo la parchan al escribir, así la decisión de apertura es una
+# búsqueda en un dict. Cambios hechos fuera del servidor (sqliteCli) se
+# ven al llamar load_auth_cache() o, para tarjetas nuevas, en el primer uso.
+_auth_lock = threading.Lock()
+_auth_cache = None
+
+
+def load_auth_cache():
+    """(Re)carga el índice de tarjetas desde la DB"""
+    global _auth_cache
+    with connection() as conn:
+        rows = conn.execute("SELECT id, activo, nombre, tipoId FROM usuarios")
+        cache = {row[0]: (row[1] == 1, row[2], row[3]) for row in rows}
+    with _auth_lock:
+        _auth_cache = cache
+    logging.info(f"🗂️ Caché de tarjetas cargada ({len(cache)} usuarios)")
+    return cache
+
+
+def invalidate_auth_cache():
+    """Descarta la caché; se recarga en la siguiente búsqueda"""
+    global _auth_cache
+    with _auth_lock:
+        _auth_cache = None
+
+
+def _patch_auth(id, entry):
+    with _auth_lock:
+        if _auth_cache is None:
+            return
+        if entry is None:
+            _auth_cache.pop(id, None)
         else:
-            return None
-
-    except FileNotFoundError:
-        print(f"El archivo config.json no existe")
-    except json.JSONDecodeError:
-        print("Error al decodificar el JSON")
-    except Exception as e:
-        print(f"Error inesperado: {e}")
+            _auth_cache[id] = entry
+
+
+def lookup_tarjeta(id):
+    """Devuelve (activo, nombre, tipoId) de la tarjeta o None si no existe"""
+    cache = _auth_cache
+    if cache is None:
+        cache = load_auth_cache()
+    entry = cache.get(id)
+    if entry is None:
+        # Tarjeta desconocida: confirmar en la DB por si se agregó desde fuera
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT activo, nombre, tipoId FROM usuarios WHERE id=?", (id,)
+            ).fetchone()
+        if row:
+            entry = (row[0] == 1, row[1], row[2])
+            _patch_auth(id, entry)
+    return entry
+
+
+# ==========  Bitácora de accesos ============================
+# log_acceso() sólo encola (no toca la DB en el hilo del lector ni de la
+# cerradura); AccessLogWriter escribe por lotes en una sola transacción,
+# actualiza el resumen por hora y borra lo que supera la retención.
+class AccessLogWriter:
+    def __init__(
+        self,
+        flush_interval=0.5,
+        batch_size=100,
+        retention_days=90,
+        rollup_retention_days=730,
+        queue_size=10000,
+        max_retries=5,
+        retry_delay=1.0,
+    ):
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries  # reintentos de un lote antes de descartarlo
+        self.retry_delay = retry_delay  # espera inicial, se duplica en cada reintento
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.rollup_retention_days = rollup_retention_days
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.written = 0
+        self._running = False
+        self._thread = None
+        self._last_prune = 0.0
+
+    def log(self, tipo, usuarioId=None, autorizado=None, detalle=None, clip=None):
+        fecha = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        autorizado = None if autorizado is None else int(autorizado)
+        try:
+            self.queue.put_nowait((fecha, tipo, usuarioId, autorizado, detalle, clip))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo escribiendo lo que quede en la cola"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _next_batch(self):
+        lote = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(lote) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    lote.append(self.queue.get_nowait())
+                else:
+                    lote.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return lote
+
+    def _run(self):
+        lote = []
+        intentos = 0
+        while self._running or lote or not self.queue.empty():
+            # Un lote que falló se reintenta antes de tomar eventos nuevos
+            lote = lote or self._next_batch()
+            try:
+                if lote:
+                    self._write(lote)
+                    lote = []
+                    intentos = 0
+                if time.monotonic() - self._last_prune > 3600:
+                    self._last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                if not lote:  # falló la depuración, no hay accesos en juego
+                    logger.error(f"⚠️ Error depurando bitácora de accesos: {e}")
+                    time.sleep(self.retry_delay)
+                    continue
+                intentos += 1
+                # Detenido, sólo un último intento: no retrasar el apagado
+                if intentos > self.max_retries or not self._running:
+                    self.dropped += len(lote)
+                    logger.error(
+                        f"❌ Bitácora: {len(lote)} accesos descartados "
+                        f"tras {intentos} intentos: {e}"
+                    )
+                    lote = []
+                    intentos = 0
+                    continue
+                logger.error(f"⚠️ Error escribiendo bitácora (intento {intentos}): {e}")
+                time.sleep(min(self.retry_delay * 2 ** (intentos - 1), 30))
+
+    def _write(self, lote):
+        resumen = {}
+        for fecha, tipo, _, autorizado, _, _ in lote:
+            clave = (fecha[:13] + ":00", tipo, autorizado or 0)
+            resumen[clave] = resumen.get(clave, 0) + 1
+        with connection() as conn:
+            conn.executemany(
+                """INSERT INTO accesos
+                (fecha, tipo, usuarioId, autorizado, detalle, clip)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                lote,
+            )
+            conn.executemany(
+                """INSERT INTO accesos_hora (hora, tipo, autorizado, total)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (hora, tipo, autorizado)
+                DO UPDATE SET total = total + excluded.total""",
+                [(*clave, total) for clave, total in resumen.items()],
+            )
+            conn.commit()
+        self.written += len(lote)
+
+    def prune(self):
+        """Borra accesos y resúmenes más viejos que la retención"""
+        with connection() as conn:
+            c = conn.execute(
+                "DELETE FROM accesos WHERE fecha < datetime('now', ?)",
+                (f"-{int(self.retention_days)} days",),
+            )
+            conn.execute(
+                """DELETE FROM accesos_hora
+                WHERE hora < strftime('%Y-%m-%d %H:00', 'now', ?)""",
+                (f"-{int(self.rollup_retention_days)} days",),
+            )
+            conn.commit()
+        if c.rowcount:
+            logging.info(f"🧹 Bitácora: {c.rowcount} accesos fuera de retención")
+
+
+_access_log = None
+
+
+def start_access_log(**kwargs):
+    """Arranca el escritor de la bitácora (kwargs de AccessLogWriter)"""
+    global _access_log
+    _access_log = AccessLogWriter(**kwargs)
+    _access_log.start()
+    return _access_log
+
+
+def stop_access_log():
+    if _access_log is not None:
+        _access_log.stop()
+
+
+def log_acceso(tipo, usuarioId=None, autorizado=None, detalle=None, clip=None):
+    """Registra un acceso ('tarjeta', 'remoto', 'timbre') sin bloquear.
+
+    `clip` es el nombre del video del evento (ver clips.ClipRecorder)."""
+    if _access_log is not None:
+        _access_log.log(tipo, usuarioId, autorizado, detalle, clip)
+
+
+def list_accesos(limite=50, antes=None, tipo=None, usuarioId=None):
+    """Página de accesos, más recientes primero, paginada por id.
+
+    Devuelve (accesos, siguiente_cursor)."""
+    condiciones = []
+    params = []
+    if antes:
+        condiciones.append("a.id < ?")
+        params.append(int(antes))
+    if tipo:
+        condiciones.append("a.tipo = ?")
+        params.append(tipo)
+    if usuarioId:
+        condiciones.append("a.usuarioId = ?")
+        params.append(usuarioId)
+    query = """
+        SELECT a.*, u.nombre
+        FROM accesos a
+        LEFT JOIN usuarios u ON a.usuarioId = u.id
+    """
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    query += " ORDER BY a.id DESC LIMIT ?"
+    params.append(limite + 1)
+    with connection() as conn:
+        accesos = conn.execute(query, params).fetchall()
+    siguiente = None
+    if len(accesos) > limite:
+        accesos = accesos[:limite]
+        siguiente = accesos[-1]["id"]
+    return accesos, siguiente
+
+
+def resumen_accesos(desde, hasta=None):
+    """Conteos por hora entre `desde` y `hasta` ('YYYY-MM-DD HH:00', UTC)"""
+    query = "SELECT * FROM accesos_hora WHERE hora >= ?"
+    params = [desde]
+    if hasta:
+        query += " AND hora <= ?"
+        params.append(hasta)
+    with connection() as conn:
+        return conn.execute(query + " ORDER BY hora", params).fetchall()
@@ -0,0 +1,102 @@
+import json
+import threading
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------
+# 📢 Bus de eventos para SSE (/events)
+# ------------------------------------------------------------------
+class Subscription:
+    """Cola acotada de un suscriptor; al llenarse descarta el evento más viejo."""
+
+    def __init__(self, bus, size):
+        self.bus = bus
+        self.queue = collections.deque(maxlen=size)
+        self.dropped = 0
+
+    def push(self, entry):
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(entry)
+
+    def get(self, timeout=None):
+        """Devuelve los eventos pendientes; espera hasta `timeout` si no hay."""
+        event = self.bus.notifier.event
+        with self.bus.lock:
+            if not self.queue:
+                pending = None
+            else:
+                pending = list(self.queue)
+                self.queue.clear()
+        if pending is not None:
+            return pending
+        event.wait(timeout)
+        with self.bus.lock:
+            pending = list(self.queue)
+            self.queue.clear()
+        return pending
+
+
+class EventBus:
+    """Publica cada evento a todos los suscriptores SSE.
+
+    Cada evento recibe un id incremental y se guarda ya serializado en un
+    buffer circular de `history` eventos, para repetir lo perdido cuando un
+    cliente se reconecta con la cabecera Last-Event-ID.
+    """
+
+    def __init__(self, notifier, history=200, queue_size=100):
+        self.notifier = notifier
+        self.lock = threading.Lock()
+        self.queue_size = queue_size
+        self._history = collections.deque(maxlen=history)
+        self._subscribers = set()
+        self._last_id = 0
+
+    @staticmethod
+    def _format(event_id, event, data):
+        payload = dict(data) if isinstance(data, dict) else {"data": data}
+        payload.setdefault("type", event)
+        return f"id: {event_id}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+    def publish(self, event, data):
+        """Publica un evento; se puede llamar desde cualquier hilo."""
+        with self.lock:
+            self._last_id += 1
+            entry = (self._last_id, self._format(self._last_id, event, data))
+            self._history.append(entry)
+            for sub in self._subscribers:
+                sub.push(entry)
+        self.notifier.notify()
+        return entry[0]
+
+    def subscribe(self, last_event_id=None):
+        """Registra un suscriptor; repite los eventos posteriores a last_event_id."""
+        sub = Subscription(self, self.queue_size)
+        with self.lock:
+            try:
+                last = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last = None
+            # Un id mayor al actual viene de antes de un reinicio: no repetir
+            if last is not None and last <= self._last_id:
+                for entry in self._history:
+                    if entry[0] > last:
+                        sub.push(entry)
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self._subscribers.discard(sub)
+        if sub.dropped:
+            logger.info(
+                f"📢 Suscriptor SSE cerrado ({sub.dropped} eventos descartados)"
+            )
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
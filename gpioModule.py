@@ -0,0 +1,176 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------
+# 🧪 Backend GPIO simulado
+# ------------------------------------------------------------------
+class SimulatedGPIO:
+    """Imita la API de RPi.GPIO para correr y probar sin Raspberry Pi.
+
+    Guarda el nivel de cada pin y dispara los callbacks registrados con
+    add_event_detect cuando se simula un flanco con set_input()/press().
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    FALLING = 32
+    RISING = 31
+    BOTH = 33
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.levels = {}
+        self.modes = {}
+        self._events = {}  # pin -> [edge, callbacks, bouncetime, último flanco]
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        with self._lock:
+            self.modes[pin] = mode
+            if mode == self.OUT:
+                self.levels[pin] = self.LOW if initial is None else initial
+            else:
+                self.levels[pin] = (
+                    self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+                )
+
+    def output(self, pin, value):
+        with self._lock:
+            self.levels[pin] = value
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if pin in self._events:
+                raise RuntimeError(f"Conflicting edge detection on pin {pin}")
+            self._events[pin] = [edge, [callback] if callback else [], bouncetime, None]
+
+    def add_event_callback(self, pin, callback):
+        self._events[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        with self._lock:
+            self._events.pop(pin, None)
+
+    def set_input(self, pin, value):
+        """Cambia el nivel de una entrada y dispara callbacks si hay flanco."""
+        with self._lock:
+            old = self.levels.get(pin, self.LOW)
+            self.levels[pin] = value
+            event = self._events.get(pin)
+            if event is None or old == value:
+                return
+            edge, callbacks, bouncetime, last = event
+            if edge == self.RISING and value != self.HIGH:
+                return
+            if edge == self.FALLING and value != self.LOW:
+                return
+            now = time.monotonic()
+            if bouncetime and last is not None and (now - last) * 1000 < bouncetime:
+                return
+            event[3] = now
+            callbacks = list(callbacks)
+        for callback in callbacks:
+            callback(pin)
+
+    def press(self, pin, active_low=True):
+        """Simula pulsar y soltar un botón."""
+        self.set_input(pin, self.LOW if active_low else self.HIGH)
+        self.set_input(pin, self.HIGH if active_low else self.LOW)
+
+    def cleanup(self, *args):
+        with self._lock:
+            self._events.clear()
+            self.levels.clear()
+            self.modes.clear()
+
+
+def get_gpio(backend="rpi"):
+    """Devuelve el módulo RPi.GPIO o un SimulatedGPIO según gpio.backend."""
+    if backend == "sim":
+        return SimulatedGPIO()
+    import RPi.GPIO as GPIO
+
+    return GPIO
+
+
+# ------------------------------------------------------------------
+# 🛎️ Entradas por flanco (timbre, botón)
+# ------------------------------------------------------------------
+class InputManager:
+    """Entradas GPIO atendidas por detección de flancos, sin sondeo.
+
+    Cada entrada se registra con add_input(); el backend GPIO avisa del
+    flanco (con `bouncetime` para filtrar el rebote del contacto) y se
+    despachan los handlers registrados. `holdoff` ignora pulsaciones
+    repetidas dentro de ese periodo (el antiguo anti-rebote de 2 s).
+    """
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self._inputs = {}  # pin -> dict de la entrada
+
+    def add_input(
+        self, name, pin, pullup=True, handler=None, bouncetime=200, holdoff=2.0
+    ):
+        gpio = self.gpio
+        gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP if pullup else gpio.PUD_DOWN)
+        self._inputs[pin] = {
+            "name": name,
+            "handlers": [handler] if handler else [],
+            "holdoff": holdoff,
+            "last": 0.0,
+        }
+        # Con pull-up el botón conecta a tierra: se activa en flanco de bajada
+        edge = gpio.FALLING if pullup else gpio.RISING
+        gpio.add_event_detect(pin, edge, callback=self._dispatch, bouncetime=bouncetime)
+        logger.info(f"✅ GPIO pin {pin} configurado como entrada '{name}'")
+
+    def on(self, name, handler):
+        """Registra otro handler para la entrada `name`."""
+        for entry in self._inputs.values():
+            if entry["name"] == name:
+                entry["handlers"].append(handler)
+                return
+        raise KeyError(name)
+
+    def _dispatch(self, pin):
+        entry = self._inputs.get(pin)
+        if entry is None:
+            return
+        now = time.monotonic()
+        if now - entry["last"] < entry["holdoff"]:
+            logger.debug(f"⏳ Entrada '{entry['name']}' ignorada (anti-rebote)")
+            return
+        entry["last"] = now
+        for handler in entry["handlers"]:
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"⚠️ Error en handler de '{entry['name']}': {e}")
+
+    def close(self):
+        for pin in list(self._inputs):
+            try:
+                self.gpio.remove_event_detect(pin)
+            except Exception:
+                pass
+        self._inputs.clear()
@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LockController:
+    """Dueño del pin de la cerradura magnética.
+
+    open() regresa de inmediato: activa el pin (si no lo estaba) y fija el
+    plazo de cierre. Si llega otra apertura mientras la puerta está
+    abierta, el plazo se extiende en lugar de crear otro hilo. Un único
+    hilo espera el plazo y vuelve a cerrar.
+
+    La duración se limita a `max_duration` y el hilo cierra la puerta
+    ante cualquier error: nunca queda abierta por un fallo.
+    """
+
+    WAIT_STEP = 1.0  # espera máxima por vuelta antes de revisar el plazo
+
+    def __init__(
+        self,
+        gpio,
+        pin,
+        active_high=True,
+        unlock_duration=3.0,
+        max_duration=30.0,
+        on_change=None,
+    ):
+        self.gpio = gpio
+        self.pin = pin
+        self.active_high = active_high
+        self.unlock_duration = unlock_duration
+        self.max_duration = max_duration
+        self.on_change = on_change
+        self._cond = threading.Condition()
+        self._deadline = None
+        self._running = True
+        gpio.setup(pin, gpio.OUT, initial=self._level(False))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _level(self, unlocked):
+        high = unlocked == self.active_high
+        return self.gpio.HIGH if high else self.gpio.LOW
+
+    @property
+    def is_open(self):
+        return self._deadline is not None
+
+    def clamp(self, duration=None):
+        """Duración efectiva: unlock_duration si falta o no es válida, y
+        nunca más de max_duration."""
+        if not duration or not math.isfinite(duration) or duration < 0:
+            duration = self.unlock_duration
+        return min(duration, self.max_duration)
+
+    def open(self, duration=None):
+        """Abre (o mantiene abierta) la puerta `duration` segundos más.
+
+        Devuelve la duración aplicada (ver clamp())."""
+        duration = self.clamp(duration)
+        with self._cond:
+            if not self._running:
+                # Sin hilo que la vuelva a cerrar no se abre
+                logger.error("❌ Cerradura detenida, apertura ignorada")
+                return 0
+            deadline = time.monotonic() + duration
+            opened = self._deadline is None
+            if opened:
+                self.gpio.output(self.pin, self._level(True))
+                self._deadline = deadline
+            elif deadline > self._deadline:
+                self._deadline = deadline
+            self._cond.notify()
+        if opened:
+            logger.info(f"🔓 Cerradura activada ({duration}s)")
+            self._notify("open")
+        else:
+            logger.info(f"🔓 Apertura extendida ({duration}s)")
+        return duration
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._running and self._deadline is None:
+                        self._cond.wait()
+                    if not self._running:
+                        return
+                    remaining = self._deadline - time.monotonic()
+                    if remaining > 0:
+                        # El plazo puede extenderse mientras esperamos
+                        self._cond.wait(min(remaining, self.WAIT_STEP))
+                        continue
+                    self.gpio.output(self.pin, self._level(False))
+                    self._deadline = None
+                logger.info("🔒 Cerradura desactivada")
+                self._notify("closed")
+        except Exception as e:
+            logger.error(f"❌ Error en el hilo de la cerradura: {e}")
+        finally:
+            # Falla segura: pase lo que pase, la puerta queda cerrada
+            with self._cond:
+                self._running = False
+                abierta = self._deadline is not None
+                self._deadline = None
+                try:
+                    self.gpio.output(self.pin, self._level(False))
+                except Exception as e:
+                    logger.error(f"❌ No se pudo cerrar la cerradura: {e}")
+            if abierta:
+                self._notify("closed")
+
+    def _notify(self, status):
+        if self.on_change:
+            try:
+                self.on_change(status)
+            except Exception as e:
+                logger.error(f"⚠️ Error notificando estado de la puerta: {e}")
+
+    def stop(self):
+        """Cierra la puerta y termina el hilo."""
+        with self._cond:
+            self._running = False
+            self.gpio.output(self.pin, self._level(False))
+            self._deadline = None
+            self._cond.notify()
+        self._thread.join(timeout=1)
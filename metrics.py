@@ -0,0 +1,126 @@
+import bisect
+import threading
+import time
+
+# Reloj de todas las mediciones (monótono, alta resolución)
+now = time.perf_counter
+
+# Límites en segundos: de medio milisegundo a unos segundos
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+# ------------------------------------------------------------------
+# 📊 Histogramas de latencia
+# ------------------------------------------------------------------
+class Histogram:
+    """Histograma de cubetas fijas; observe() sólo incrementa contadores.
+
+    Las cubetas se reservan al crearlo, así que registrar una medición en
+    el camino caliente (lector, cerradura, cámara) no crea listas ni dicts.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # la última es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def since(self, start):
+        """Registra el tiempo transcurrido desde `start` (metrics.now())."""
+        self.observe(now() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Registry:
+    """Métricas del proceso en formato de texto de Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # nombre -> (ayuda, {etiquetas: Histogram})
+        self._gauges = {}  # nombre -> (ayuda, fn)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, **labels):
+        """Devuelve (creándolo si hace falta) el histograma name{labels}."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, series = self._histograms.setdefault(name, (help, {}))
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = Histogram(buckets)
+            return hist
+
+    def gauge(self, name, help, fn):
+        """Valor leído al exportar: fn() devuelve un número o una lista de
+        (etiquetas, valor) para varias series."""
+        with self._lock:
+            self._gauges[name] = (help, fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = [(n, h, dict(s)) for n, (h, s) in self._histograms.items()]
+            gauges = list(self._gauges.items())
+        for name, help, series in histograms:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, hist in series.items():
+                counts, total, count = hist.snapshot()
+                acumulado = 0
+                for bound, n in zip(hist.bounds + (float("inf"),), counts):
+                    acumulado += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f"{name}_bucket{_labels(key + (('le', le),))} {acumulado}"
+                    )
+                lines.append(f"{name}_sum{_labels(key)} {total}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+        for name, (help, fn) in gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if isinstance(value, list):
+                for labels, v in value:
+                    lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {v}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+histogram = REGISTRY.histogram
+gauge = REGISTRY.gauge
+render = REGISTRY.render
@@ -1,9 +1,10 @@
 import serial
+import collections
 import threading
 import time
 import logging
-from buzzer import BuzzerManager
 import db
+import metrics
 
 # --- Configuración general ---
 
@@ -14,125 +15,302 @@ BAUD = 9600
 # READ_INTERVAL = 0.1  # segundos entre lecturas
 # DEBOUNCE_TIME = 2.0  # tiempo mínimo entre lecturas del mismo ID
 
-# Valores nuevos a prueba
-READ_INTERVAL = 0.05  # intervalo de lectura rápida
+READ_TIMEOUT = 0.1  # espera máxima de ser.read() antes de revisar reader_running
 DEBOUNCE_TIME = 1.5  # no leer la misma tarjeta antes de 1.5s
 
+# Trama RDM6300: STX + 10 ASCII hex (versión + tag) + 2 ASCII hex checksum + ETX
+FRAME_LEN = 14
+STX = 0x02
+ETX = 0x03
+HEX_DIGITS = frozenset(b"0123456789ABCDEFabcdef")
+
+# Cola entre el lector y el despachador: tarjetas en espera y qué hacer si
+# se llena ("drop_oldest" descarta la más vieja, "drop_newest" la nueva)
+QUEUE_SIZE = 8
+QUEUE_POLICY = "drop_oldest"
+
 learn_mode = False  # modo aprendizaje activable desde el panel
-reader_running = True
+reader_running = False
+_reader_thread = None
+_dispatcher = None
 
 _last_id = None
 _last_time = 0
 
-buzzer = BuzzerManager()
+_STAGE_HELP = "Latencia por etapa de la lectura de tarjeta"
+_uart_hist = metrics.histogram("vport_card_stage_seconds", _STAGE_HELP, stage="uart")
+_debounce_hist = metrics.histogram(
+    "vport_card_stage_seconds", _STAGE_HELP, stage="debounce"
+)
+_queue_hist = metrics.histogram("vport_card_stage_seconds", _STAGE_HELP, stage="queue")
+_handle_hist = metrics.histogram(
+    "vport_card_stage_seconds", _STAGE_HELP, stage="handle"
+)
+
+
+# --- Parser de tramas (sin hardware) ---
+def decode_frame(frame):
+    """Valida una trama de 14 bytes y devuelve el ID (8 hex) o None.
+
+    El checksum es el XOR de los 5 bytes codificados en los 10 caracteres
+    de datos y debe coincidir con el byte de los caracteres 11-12.
+    """
+    if len(frame) != FRAME_LEN or frame[0] != STX or frame[-1] != ETX:
+        return None
+    payload = bytes(frame[1:13])
+    # fromhex() acepta espacios: sin esta revisión "0000 0000 00" da menos
+    # de 6 bytes y raw[5] revienta el hilo del lector
+    if not all(c in HEX_DIGITS for c in payload):
+        return None
+    raw = bytes.fromhex(payload.decode("ascii"))
+    if raw[0] ^ raw[1] ^ raw[2] ^ raw[3] ^ raw[4] != raw[5]:
+        return None
+    return frame[3:11].decode("ascii").upper()
+
+
+def parse_frames(data):
+    """Extrae los IDs de todas las tramas válidas contenidas en `data`.
+
+    Devuelve (ids, consumidos): los bytes a partir de `consumidos` pueden
+    ser una trama incompleta y deben conservarse para la siguiente lectura.
+    Los bytes basura y las tramas con checksum inválido se descartan.
+    """
+    ids = []
+    i = 0
+    n = len(data)
+    while True:
+        start = data.find(STX, i)
+        if start < 0:
+            return ids, n
+        if n - start < FRAME_LEN:
+            return ids, start
+        id = decode_frame(data[start : start + FRAME_LEN])
+        if id is None:
+            logging.debug(
+                f"⚠️ Trama ignorada: {bytes(data[start : start + FRAME_LEN]).hex(' ')}"
+            )
+            i = start + 1
+            continue
+        ids.append(id)
+        i = start + FRAME_LEN
+
+
+def _accept_id(id):
+    """Anti-rebote: ignora la misma tarjeta leída antes de DEBOUNCE_TIME."""
+    global _last_id, _last_time
+    now = time.time()
+    if id != _last_id or (now - _last_time) > DEBOUNCE_TIME:
+        _last_id = id
+        _last_time = now
+        return True
+    return False
+
+
+# --- Despacho de tarjetas ---
+class CardDispatcher:
+    """Cola acotada entre el hilo del lector y el callback del servidor.
+
+    El lector sólo parsea y encola; el hilo "nfc-dispatch" hace el modo
+    aprendizaje (bcrypt), la búsqueda, la bitácora y la cerradura. Así una
+    DB lenta no deja de vaciar el UART y no se pierden ni mezclan tramas.
+
+    Una tarjeta que ya está en espera no se vuelve a encolar (coalesced);
+    con la cola llena se aplica `policy` y se cuenta en `dropped`.
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest")
+
+    def __init__(
+        self, callback, on_read=None, queue_size=QUEUE_SIZE, policy=QUEUE_POLICY
+    ):
+        if policy not in self.POLICIES:
+            logging.warning(
+                f"⚠️ Política de cola NFC inválida {policy!r}, uso {QUEUE_POLICY}"
+            )
+            policy = QUEUE_POLICY
+        self.callback = callback
+        self.on_read = on_read
+        self.queue_size = max(1, queue_size)
+        self.policy = policy
+        self.queued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.handled = 0
+        self._pending = collections.deque()  # (id, read_at, encolado)
+        self._cond = threading.Condition()
+        self._saturated = False
+        self._running = False
+        self._thread = None
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, id, read_at=None):
+        """Encola una tarjeta sin bloquear; devuelve False si no se encoló."""
+        with self._cond:
+            if any(pending[0] == id for pending in self._pending):
+                self.coalesced += 1
+                return False
+            if len(self._pending) >= self.queue_size:
+                self.dropped += 1
+                if not self._saturated:
+                    # un aviso por ráfaga, no uno por trama en el hilo del lector
+                    self._saturated = True
+                    logging.warning(f"⚠️ Cola NFC llena ({self.policy})")
+                if self.policy == "drop_newest":
+                    return False
+                self._pending.popleft()
+            self._pending.append((id, read_at, metrics.now()))
+            self.queued += 1
+            self._cond.notify()
+            return True
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="nfc-dispatch", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Detiene el hilo; las tarjetas aún en espera se descartan."""
+        with self._cond:
+            self._running = False
+            pendientes = len(self._pending)
+            self._pending.clear()
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if pendientes:
+            logging.info(f"🛑 {pendientes} tarjetas en espera descartadas")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                id, read_at, encolado = self._pending.popleft()
+                if not self._pending:
+                    self._saturated = False
+            _queue_hist.since(encolado)
+            if self.on_read:
+                try:
+                    self.on_read()
+                except Exception as e:
+                    logging.error(f"⚠️ Error en aviso de lectura NFC: {e}")
+            handle_id(id, self.callback, read_at)
+            self.handled += 1
+
+
+def _queue_counts():
+    if _dispatcher is None:
+        return []
+    return [
+        ({"result": "queued"}, _dispatcher.queued),
+        ({"result": "coalesced"}, _dispatcher.coalesced),
+        ({"result": "dropped"}, _dispatcher.dropped),
+        ({"result": "handled"}, _dispatcher.handled),
+    ]
+
+
+metrics.gauge(
+    "vport_card_queue_reads", "Tarjetas por resultado en la cola NFC", _queue_counts
+)
+metrics.gauge(
+    "vport_card_queue_depth",
+    "Tarjetas esperando al despachador",
+    lambda: _dispatcher.depth if _dispatcher else 0,
+)
 
 
 # --- Lectura UART (RDM6300) ---
-def start_reader(callback):
-    """Inicia el hilo de lectura NFC (por UART)."""
-    global reader_running, _last_id, _last_time
+def start_reader(callback, on_read=None, queue_size=QUEUE_SIZE, policy=QUEUE_POLICY):
+    """Inicia el hilo de lectura NFC (por UART) y su despachador.
+
+    `callback(id, read_at=...)` corre en el hilo del despachador;
+    `on_read()` se llama con cada tarjeta antes del callback (p. ej. para
+    el pitido del buzzer)."""
+    global reader_running, _reader_thread, _dispatcher
+    _dispatcher = CardDispatcher(
+        callback, on_read, queue_size=queue_size, policy=policy
+    )
+    _dispatcher.start()
+    dispatcher = _dispatcher
     reader_running = True
     logging.info(f"📡 Lector NFC UART iniciado en {PORT}")
 
     def reader_loop():
-        global _last_id, _last_time
         try:
-            with serial.Serial(PORT, BAUD, timeout=0.05) as ser:
-                buffer = b""
+            with serial.Serial(PORT, BAUD, timeout=READ_TIMEOUT) as ser:
+                buffer = bytearray()
                 while reader_running:
-                    if ser.in_waiting:
-                        byte = ser.read()
-                        if not byte:
-                            continue
-
-                        # Inicio de trama
-                        if byte == b"\x02":
-                            buffer = b"\x02"
-                            continue
-
-                        # Acumulación
-                        if buffer:
-                            buffer += byte
-
-                            # Fin de trama
-                            if byte == b"\x03":
-                                frame_len = len(buffer)
-
-                                if frame_len == 14:
-                                    try:
-                                        id_raw = buffer[3:11]
-                                        id = (
-                                            id_raw.decode("ascii", errors="ignore")
-                                            .strip()
-                                            .upper()
-                                        )
-
-                                        if not all(c in "0123456789ABCDEF" for c in id):
-                                            logging.warning(
-                                                f"⚠️ ID no hexadecimal: {id}"
-                                            )
-                                            buffer = b""
-                                            continue
-
-                                        now = time.time()
-                                        if (
-                                            id != _last_id
-                                            or (now - _last_time) > DEBOUNCE_TIME
-                                        ):
-                                            _last_id = id
-                                            _last_time = now
-                                            logging.info(
-                                                f"🎫 Tarjeta detectada ID={id}"
-                                            )
-                                            buzzer.alert_pattern("success")
-                                            handle_id(id, callback)
-                                        else:
-                                            logging.debug(
-                                                f"⏳ ID repetido ignorado: {id}"
-                                            )
-
-                                    except Exception as e:
-                                        logging.warning(
-                                            f"⚠️ Error decodificando ID: {e}"
-                                        )
-                                else:
-                                    logging.debug(
-                                        f"⚠️ Trama ignorada (len={frame_len}): {buffer.hex(' ')}"
-                                    )
-
-                                buffer = b""
-
-                        if len(buffer) > 20:
-                            buffer = b""
-
-                    else:
-                        time.sleep(READ_INTERVAL)
+                    # Bloquea hasta completar una trama (o timeout) y toma
+                    # de una vez todo lo que ya esté en el puerto
+                    need = max(1, FRAME_LEN - len(buffer))
+                    chunk = ser.read(max(need, ser.in_waiting))
+                    if not chunk:
+                        continue
+                    # read() regresa al recibir el ETX: es el inicio de la latencia
+                    read_at = metrics.now()
+                    buffer += chunk
+                    ids, consumed = parse_frames(buffer)
+                    del buffer[:consumed]
+                    if ids:
+                        _uart_hist.since(read_at)
+
+                    for id in ids:
+                        start = metrics.now()
+                        accepted = _accept_id(id)
+                        _debounce_hist.since(start)
+                        if accepted:
+                            logging.info(f"🎫 Tarjeta detectada ID={id}")
+                            dispatcher.submit(id, read_at)
+                        else:
+                            logging.debug(f"⏳ ID repetido ignorado: {id}")
         except serial.SerialException as e:
             logging.error(f"❌ Error abriendo puerto serial {PORT}: {e}")
         except Exception as e:
             logging.error(f"❌ Error crítico en lector NFC: {e}")
 
-    threading.Thread(target=reader_loop, daemon=True).start()
+    _reader_thread = threading.Thread(
+        target=reader_loop, name="nfc-reader", daemon=True
+    )
+    _reader_thread.start()
+
 
+def handle_id(id, callback, read_at=None):
+    """Ejecuta el callback que viene del servidor.
 
-def handle_id(id, callback):
-    global learn_mode
-    """Ejecuta el callback que viene del servidor."""
+    `read_at` (metrics.now() de la lectura UART) se pasa al callback para
+    medir la latencia de tarjeta a apertura."""
+    start = metrics.now()
     try:
         # if is_usuario_activo(id):
         if learn_mode:
-            db.add_usuario(id, f"Nueva tarjeta ({id})", "usuario", 1)
+            db.add_usuario(id, f"Nueva tarjeta ({id})", "", "", None, "", activo=1)
             logging.info(f"🧠 Modo aprendizaje: tarjeta {id} agregada automáticamente")
         if callback:
-            callback(id)
+            callback(id, read_at=read_at)
         else:
             logging.warning("⚠️ No hay callback asignado para procesar el ID.")
     except Exception as e:
         logging.error(f"⚠️ Error ejecutando callback NFC: {e}")
+    finally:
+        _handle_hist.since(start)
 
 
 def stop_reader():
     """Detiene la lectura del módulo NFC"""
-    global reader_running
+    global reader_running, _reader_thread
     reader_running = False
+    # read() despierta cada READ_TIMEOUT para revisar reader_running
+    if _reader_thread is not None:
+        _reader_thread.join(timeout=READ_TIMEOUT * 10)
+        _reader_thread = None
+    if _dispatcher is not None:
+        _dispatcher.stop()
     logging.info("🛑 Lector NFC detenido")
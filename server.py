@@ -1,6 +1,15 @@
 #!/usr/bin/env python3
 # version 6: video + cerradura + config externa + alerta botón físico
 
+from bridge import MODES, monkey_patch, create_bridge
+from settings import Settings
+
+if __name__ == "__main__":
+    # Como programa, la configuración se lee antes de importar Flask: el
+    # modo (werkzeug | gevent) decide si gevent parchea la librería estándar
+    _settings = Settings()
+    monkey_patch(_settings["server"]["mode"])
+
 from flask import (
     Flask,
     Response,
@@ -11,116 +20,121 @@ from flask import (
     url_for,
     session,
     stream_with_context,
-    g,
     flash,
+    send_file,
 )
 from flask_socketio import SocketIO
 from flask_cors import CORS
-from picamera2 import Picamera2
-import io, threading, time, logging, json, sys, math
-import queue, nfcModule, db
+import threading, time, logging, json, math, csv, io
+import nfcModule, gpioModule, db, camera, metrics
+from concurrent.futures import ThreadPoolExecutor
+from lock import LockController
+from buzzer import BuzzerManager
+from events import EventBus
+from camera import frame_bytes
+from clips import FrameRing, ClipRecorder
+from auth import LoginManager, LoginThrottled
 from functools import wraps
 from datetime import timedelta, datetime
 
+logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------
-# 🔧 Configuración
+# 🧩 Estado de la aplicación
 # ------------------------------------------------------------------
-DEFAULT_CONFIG = {
-    "camera": {"resolution": [640, 480], "format": "XBGR8888", "frame_interval": 0.05},
-    "server": {"host": "0.0.0.0", "port": 5000, "debug": False},
-    "lock": {"gpio_pin": 17, "active_high": True, "unlock_duration": 3.0},
-    "button": {"gpio_pin": 27, "pullup": True},
-    "security": {"api_token": "1234"},
-    "logging": {"level": "INFO"},
-}
-
-
-def load_config(path="config.json"):
-    config = DEFAULT_CONFIG.copy()
-    try:
-        with open(path, "r") as f:
-            user_cfg = json.load(f)
-            for key, val in user_cfg.items():
-                if isinstance(val, dict) and key in config:
-                    config[key].update(val)
-                else:
-                    config[key] = val
-        print(f"✅ Configuración cargada desde {path}")
-    except FileNotFoundError:
-        print(f"⚠️ No se encontró {path}, usando configuración por defecto.")
-    except Exception as e:
-        print(f"⚠️ Error leyendo {path}: {e}")
-    return config
-
-
-config = load_config()
+# Importar este módulo no toca hardware: create_app() arma los objetos y
+# start()/stop() encienden y apagan cámara, GPIO, lector y bitácora.
+config = None
+SERVER_MODE = "werkzeug"
+bridge = None  # puente entre los hilos de hardware y el servidor
+camera_manager = None
+camera_executor = None  # hilo nativo para arrancar/apagar la cámara
+pipeline = None
+clip_recorder = None
+login_manager = None
+event_bus = None
+GPIO = None
+lock = None
+inputs = None
+buzzer = None
 last_usuario = {"id": None, "nombre": None, "activo": False, "timestamp": None}
 
+app = Flask(__name__)
+socketio = SocketIO()
 
-# ------------------------------------------------------------------
-# 🧱 Logging
-# ------------------------------------------------------------------
-logging.basicConfig(
-    level=getattr(logging, config["logging"]["level"].upper(), logging.INFO),
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
-logger = logging.getLogger(__name__)
 
 # ------------------------------------------------------------------
 # 🎥 Cámara
 # ------------------------------------------------------------------
-picam2 = Picamera2()
-try:
-    cam_cfg = picam2.create_preview_configuration(
-        main={
-            "size": tuple(config["camera"]["resolution"]),
-            "format": config["camera"]["format"],
-        }
-    )
-    picam2.configure(cam_cfg)
-    picam2.start()
-    logger.info("✅ Cámara inicializada correctamente")
-except Exception as e:
-    logger.error(f"🚫 No se pudo inicializar la cámara: {e}")
-    sys.exit(1)
+def create_clip_recorder():
+    """Últimos segundos del perfil de clips; los frames previos al evento
+    sólo existen si la cámara ya estaba encendida (always_on o alguien viendo)"""
+    clips_cfg = config["clips"]
+    if not clips_cfg["enabled"]:
+        return None
+    try:
+        clip_broadcaster = pipeline.broadcaster(clips_cfg["profile"])
+        clip_fps = (
+            pipeline.profiles[clips_cfg["profile"]].get("fps")
+            or config["camera"]["fps"]
+        )
+        clip_ring = FrameRing(clips_cfg["pre"] + clips_cfg["post"] + 1, clip_fps)
+        clip_ring.attach(clip_broadcaster)
+        return ClipRecorder(
+            clip_ring,
+            clips_cfg["directory"],
+            pre=clips_cfg["pre"],
+            post=clips_cfg["post"],
+            quota_mb=clips_cfg["quota_mb"],
+            camera_manager=camera_manager,
+        )
+    except Exception as e:
+        logger.error(f"⚠️ Clips de eventos desactivados: {e}")
+        return None
 
 
-frame_lock = threading.Lock()
-frame = None
-running = True
+def record_clip(evento):
+    """Programa el clip de `evento` si está habilitado; devuelve su nombre."""
+    if clip_recorder is None or evento not in config["clips"]["events"]:
+        return None
+    return clip_recorder.trigger(evento)
 
 
-def capture_frames():
-    global frame
-    while running:
-        try:
-            buf = io.BytesIO()
-            picam2.capture_file(buf, format="jpeg")
-            buf.seek(0)
-            with frame_lock:
-                frame = buf.read()
-            time.sleep(config["camera"]["frame_interval"])
-        except Exception as e:
-            logger.warning(f"⚠️ Error en captura: {e}")
-            time.sleep(1)
+def acquire_camera():
+    """camera_manager.acquire() sin congelar el hub en modo gevent.
+
+    Arrancar la cámara (configure/start de Picamera2) bloquea con un
+    threading.Lock; desde un greenlet se hace en un hilo nativo y sólo
+    se espera el resultado.
+    """
+    if bridge.cooperative:
+        camera_executor.submit(camera_manager.acquire).result()
+    else:
+        camera_manager.acquire()
 
 
-threading.Thread(target=capture_frames, daemon=True).start()
+def release_camera():
+    if bridge.cooperative:
+        # Puede esperar al candado de un arranque en curso: no se espera
+        camera_executor.submit(camera_manager.release)
+    else:
+        camera_manager.release()
+
+
+def start_camera():
+    """Con always_on enciende la cámara; si falla la puerta sigue operando
+    y se reintenta con el primer cliente del stream."""
+    if not config["camera"].get("always_on"):
+        return
+    try:
+        camera_manager.acquire()
+    except Exception as e:
+        logger.error(f"🚫 No se pudo inicializar la cámara: {e}")
+
 
 # ------------------------------------------------------------------
 # 🌐 Flask + SocketIO
 # ------------------------------------------------------------------
-app = Flask(__name__)
-app.secret_key = config["security"]["pwd"]
-
-CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
-# Configurar expiración de sesión
-app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
-    minutes=config["security"]["sessionTime"]
-)
-app.config["SESSION_REFRESH_EACH_REQUEST"] = True  # Renovar con cada request
 
 
 @app.before_request
@@ -155,6 +169,21 @@ def login_required_api(f):
     return decorated_function
 
 
+# Decorador para API que requiere rol admin
+def admin_required_api(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if "user_id" not in session:
+            return jsonify(
+                {"status": "error", "message": "Session expired or user not authorized"}
+            ), 401
+        if session.get("role") != "admin":
+            return jsonify({"status": "error", "message": "Admin role required"}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
 # Decorador para requerir rol admin
 def admin_required(f):
     @wraps(f)
@@ -180,8 +209,20 @@ def login():
         username = request.form["username"]
         password = request.form["password"]
 
-        # usuario = db.verificar_usuario(username, password)
-        usuario = db.verificarUsuarioCfg(username, password)
+        try:
+            usuario = login_manager.authenticate(
+                request.remote_addr, username, password
+            )
+        except LoginThrottled as e:
+            flash("Demasiados intentos. Espera un momento.", "danger")
+            return (
+                render_template("login.html"),
+                429,
+                {"Retry-After": str(math.ceil(e.retry_after))},
+            )
+        except db.HashPoolBusy:
+            flash("Servidor ocupado, intenta de nuevo.", "warning")
+            return render_template("login.html"), 503, {"Retry-After": "1"}
 
         if usuario:
             # Guardar datos en sesión
@@ -210,14 +251,53 @@ def logout():
     return redirect(url_for("login"))
 
 
-def generate_stream():
-    global frame
-    while True:
-        with frame_lock:
-            if frame is None:
+_frame_notifiers = {}
+_frame_age_hist = metrics.histogram(
+    "vport_frame_age_seconds", "Antigüedad del frame al enviarlo a /video_feed"
+)
+
+
+def frame_notifier(broadcaster):
+    """Notificador (uno por perfil) que despierta a los clientes en cada frame.
+
+    Sirve igual en hilos que en greenlets: los frames se publican desde el
+    hilo de la cámara y en modo gevent la espera no debe bloquear el hub.
+    """
+    notifier = _frame_notifiers.get(broadcaster)
+    if notifier is None:
+        notifier = _frame_notifiers[broadcaster] = bridge.notifier()
+        broadcaster.add_listener(notifier.notify)
+    return notifier
+
+
+def generate_stream(broadcaster):
+    """Envía cada frame nuevo una sola vez; los clientes lentos saltan al último."""
+    notifier = frame_notifier(broadcaster)
+    last_seq = 0
+    try:
+        acquire_camera()
+    except Exception as e:
+        logger.error(f"🚫 No se pudo iniciar la cámara: {e}")
+        return
+    broadcaster.subscribe()
+    try:
+        while not broadcaster.closed:
+            event = notifier.event
+            seq, data = broadcaster.latest()
+            if data is None or seq <= last_seq:
+                event.wait(1.0)
                 continue
-            data = frame
-        yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + data + b"\r\n")
+            last_seq = seq
+            _frame_age_hist.since(broadcaster.published_at)
+            yield (
+                b"--frame\r\nContent-Type: image/jpeg\r\n"
+                + f"Content-Length: {data.nbytes}\r\n\r\n".encode()
+            )
+            yield frame_bytes(data)
+            yield b"\r\n"
+    finally:
+        broadcaster.unsubscribe()
+        release_camera()
 
 
 @app.route("/")
@@ -229,70 +309,190 @@ def index():
 
 @app.route("/video_feed")
 def video_feed():
+    profile = request.args.get("profile") or pipeline.default_profile
+    if profile not in pipeline.broadcasters:
+        return jsonify(
+            {
+                "status": "error",
+                "message": f"Perfil desconocido: {profile}",
+                "profiles": list(pipeline.broadcasters),
+            }
+        ), 400
     return Response(
-        generate_stream(), mimetype="multipart/x-mixed-replace; boundary=frame"
+        generate_stream(pipeline.broadcaster(profile)),
+        mimetype="multipart/x-mixed-replace; boundary=frame",
     )
 
 
+# Las secuencias de frames reinician con el proceso: el prefijo evita que
+# un ETag de la ejecución anterior coincida por casualidad
+_snapshot_boot = f"{int(time.time()):x}"
+_snapshots = {}
+
+
+def fresh_frame(broadcaster, timeout=3.0):
+    """Espera un frame posterior al arranque de la cámara (si estaba apagada)."""
+    was_running = camera_manager.running
+    last_seq = broadcaster.seq if not was_running else 0
+    acquire_camera()
+    try:
+        notifier = frame_notifier(broadcaster)
+        deadline = time.monotonic() + timeout
+        while not broadcaster.closed:
+            event = notifier.event
+            seq, data = broadcaster.latest()
+            if data is not None and seq > last_seq:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            event.wait(min(remaining, 1.0))
+        return False
+    finally:
+        # El apagado espera idle_timeout: las siguientes fotos salen al instante
+        release_camera()
+
+
+@app.route("/snapshot.jpg")
+def snapshot():
+    """Último frame como JPEG suelto, con ETag por frame (?profile=&w=)."""
+    profile = request.args.get("profile") or pipeline.default_profile
+    if profile not in pipeline.broadcasters:
+        return jsonify(
+            {"status": "error", "message": f"Perfil desconocido: {profile}"}
+        ), 400
+    broadcaster = pipeline.broadcaster(profile)
+    cache = _snapshots.get(profile)
+    if cache is None:
+        cache = _snapshots[profile] = camera.SnapshotCache(broadcaster)
+    try:
+        if not fresh_frame(broadcaster):
+            return jsonify(
+                {"status": "error", "message": "Sin imagen de la cámara"}
+            ), 503
+    except Exception as e:
+        logger.error(f"🚫 No se pudo iniciar la cámara: {e}")
+        return jsonify({"status": "error", "message": "Cámara no disponible"}), 503
+
+    width = cache.width(request.args.get("w", type=int))
+    seq = broadcaster.seq
+    etag = f"{_snapshot_boot}-{profile}-{seq}-{width or 0}"
+    headers = {"Cache-Control": "private, no-cache"}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        seq, data = cache.get(width)
+        etag = f"{_snapshot_boot}-{profile}-{seq}-{width or 0}"
+        response = Response(data, mimetype="image/jpeg", headers=headers)
+    response.set_etag(etag)
+    return response
+
+
 # ------------------------------------------------------------------
 # 🔒 Cerradura magnética
 # ------------------------------------------------------------------
-try:
-    import RPi.GPIO as GPIO
+def start_gpio():
+    """Cerradura, entradas (timbre, botón) y buzzer; sin GPIO el servidor
+    sigue funcionando (sin cerradura)."""
+    global GPIO, lock, inputs, buzzer
+    try:
+        GPIO = gpioModule.get_gpio(config["gpio"]["backend"])
+
+        LOCK_GPIO_PIN = config["lock"]["gpio_pin"]
+
+        GPIO.setmode(GPIO.BCM)
+        lock = LockController(
+            GPIO,
+            LOCK_GPIO_PIN,
+            active_high=config["lock"]["active_high"],
+            unlock_duration=config["lock"]["unlock_duration"],
+            max_duration=config["lock"]["max_duration"],
+            on_change=lambda status: broadcast_event("door_status", {"status": status}),
+        )
+        logger.info(f"✅ GPIO listo (pin {LOCK_GPIO_PIN}) para magneto remota")
 
-    LOCK_GPIO_PIN = config["lock"]["gpio_pin"]
+        # Entradas (timbre, botón) por detección de flancos
+        inputs = gpioModule.InputManager(GPIO)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo inicializar GPIO: {e}")
+        GPIO = None
+        lock = None
+        inputs = None
+        return
 
-    GPIO.setmode(GPIO.BCM)
-    GPIO.setup(
-        LOCK_GPIO_PIN,
-        GPIO.OUT,
-        initial=GPIO.LOW if config["lock"]["active_high"] else GPIO.HIGH,
-    )
-    logger.info(f"✅ GPIO listo (pin {LOCK_GPIO_PIN}) para magneto remota")
-
-    # Botón timbre
-    BTN_GPIO_PIN = config["timbre"]["gpio_pin"]
-    GPIO.setup(
-        BTN_GPIO_PIN,
-        GPIO.IN,
-        pull_up_down=GPIO.PUD_UP
-        if config["timbre"].get("pullup", True)
-        else GPIO.PUD_DOWN,
-    )
-    logger.info(f"✅ GPIO pin {BTN_GPIO_PIN} configurado como botón Timbre")
-except Exception as e:
-    logger.warning(f"⚠️ No se pudo inicializar GPIO: {e}")
-    GPIO = None
-
-# --- Buzzer opcional ---
-try:
-    BUZ_GPIO_PIN = config.get("buzzer", {}).get("gpio_pin")
-    if BUZ_GPIO_PIN:
-        GPIO.setup(BUZ_GPIO_PIN, GPIO.OUT, initial=GPIO.LOW)
-        logger.info(f"✅ GPIO pin {BUZ_GPIO_PIN} configurado para buzzer")
-except Exception as e:
-    logger.warning(f"⚠️ No se pudo inicializar buzzer: {e}")
-    BUZ_GPIO_PIN = None
+    # --- Buzzer opcional ---
+    buzzer_pin = config["buzzer"].get("gpio_pin")
+    if buzzer_pin:
+        try:
+            buzzer = BuzzerManager(GPIO, buzzer_pin)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo inicializar buzzer: {e}")
+    setup_inputs()
 
 
-def activate_lock(duration=None):
-    if GPIO is None:
-        logger.warning("GPIO no disponible, cerradura ignorada.")
+def stop_gpio():
+    global GPIO, lock, inputs, buzzer
+    if inputs:
+        inputs.close()
+    if lock:
+        lock.stop()
+    if buzzer:
+        buzzer.cleanup()
+    if GPIO:
+        GPIO.cleanup()
+    GPIO = lock = inputs = buzzer = None
+
+
+# ------------------------------------------------------------------
+# ♻️ Cambios de configuración sin reiniciar
+# ------------------------------------------------------------------
+def on_lock_config(lock_cfg):
+    if lock is None:
         return
+    lock.unlock_duration = lock_cfg["unlock_duration"]
+    lock.max_duration = lock_cfg["max_duration"]
+    if lock_cfg["gpio_pin"] != lock.pin or lock_cfg["active_high"] != lock.active_high:
+        logger.warning(
+            "⚠️ Cambiar el pin de la cerradura requiere reiniciar el servidor"
+        )
 
-    duration = duration or config["lock"]["unlock_duration"]
-    active_high = config["lock"]["active_high"]
 
+def on_buzzer_config(buzzer_cfg):
+    global buzzer
+    pin = buzzer_cfg.get("gpio_pin")
+    if GPIO is None or pin == (buzzer.buzzer_pin if buzzer else None):
+        return
     try:
-        logger.info(f"LOCK_GPIO_PIN: {LOCK_GPIO_PIN}")
-        GPIO.output(LOCK_GPIO_PIN, GPIO.HIGH if active_high else GPIO.LOW)
-        logger.info(f"🔓 Cerradura activada ({duration}s)")
-        socketio.emit("door_status", {"status": "open"})
-        time.sleep(duration)
-    finally:
-        GPIO.output(LOCK_GPIO_PIN, GPIO.LOW if active_high else GPIO.HIGH)
-        logger.info("🔒 Cerradura desactivada")
-        socketio.emit("door_status", {"status": "closed"})
+        if buzzer:
+            buzzer.cleanup()
+        buzzer = BuzzerManager(GPIO, pin) if pin else None
+        logger.info(f"✅ Buzzer ahora en GPIO pin {pin}")
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo configurar buzzer: {e}")
+
+
+def on_logging_config(logging_cfg):
+    logging.getLogger().setLevel(
+        getattr(logging, logging_cfg["level"].upper(), logging.INFO)
+    )
+
+
+_lock_hist = metrics.histogram(
+    "vport_card_stage_seconds",
+    "Latencia por etapa de la lectura de tarjeta",
+    stage="lock",
+)
+
+
+def activate_lock(duration=None):
+    """Abre la puerta sin bloquear; las aperturas seguidas extienden el plazo."""
+    if lock is None:
+        logger.warning("GPIO no disponible, cerradura ignorada.")
+        return None
+    start = metrics.now()
+    duration = lock.open(duration)
+    _lock_hist.since(start)
+    return duration
 
 
 @app.route("/api/open", methods=["POST"])
@@ -303,88 +503,133 @@ def open():
     #     abort(403, description="Token inválido")
 
     data = request.get_json(silent=True) or {}
-    duration = float(data.get("duration", config["lock"]["unlock_duration"]))
+    try:
+        duration = float(data.get("duration", config["lock"]["unlock_duration"]))
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "duration inválida"}), 400
     reason = data.get("reason", "manual")
 
-    threading.Thread(target=activate_lock, args=(duration,), daemon=True).start()
+    # La cerradura limita la duración (lock.max_duration)
+    duration = activate_lock(duration) or duration
+    db.log_acceso("remoto", session.get("user_id"), True, reason)
     logger.info(f"🔓 Apertura solicitada (razón: {reason}, duración: {duration}s)")
     return jsonify({"status": "ok", "reason": reason, "duration": duration})
 
 
 # ------------------------------------------------------------------
-# 🛎️ Escucha del botón físico
+# 🛎️ Botón físico y botón timbre
 # ------------------------------------------------------------------
-def listen_button():
-    """Escucha el botón fisico."""
-    if GPIO is None:
-        return
-    last_press = 0
-    while running:
-        if GPIO.input(BUTTON_GPIO_PIN) == (
-            GPIO.LOW if config["button"].get("pullup", True) else GPIO.HIGH
-        ):
-            now = time.time()
-            if now - last_press > 2:  # anti-rebote
-                logger.info("🚨 Botón físico presionado")
-                # buzz(0.4)
-                last_press = now
-        time.sleep(0.1)
+def on_button():
+    """Botón físico presionado."""
+    logger.info("🚨 Botón físico presionado")
 
 
-# ------------------------------------------------------------------
-# 🛎️ Escucha del botón timbre
-# ------------------------------------------------------------------
-def listen_timbre():
-    """Escucha el botón y notifica a los clientes web."""
-    if GPIO is None:
-        return
-    last_press = 0
-    while running:
-        if GPIO.input(BTN_GPIO_PIN) == (
-            GPIO.LOW if config["timbre"].get("pullup", True) else GPIO.HIGH
-        ):
-            now = time.time()
-            if now - last_press > 2:  # anti-rebote
-                logger.info("🚨 Botón timbre: solicitud de apertura")
-                buzz(0.4)
-                socketio.emit(
-                    "alert_request", {"message": "🔔 Alguien presionó el timbre"}
-                )
-                last_press = now
-        time.sleep(0.1)
-
-
-def buzz(duration=0.3):
-    """Emite un pitido corto."""
-    if BUZ_GPIO_PIN is None or GPIO is None:
+def on_timbre():
+    """Botón timbre: notifica a los clientes web."""
+    logger.info("🚨 Botón timbre: solicitud de apertura")
+    db.log_acceso("timbre", clip=record_clip("timbre"))
+    alert("timbre")
+    broadcast_event("alert_request", {"message": "🔔 Alguien presionó el timbre"})
+
+
+def setup_inputs():
+    """Registra timbre y botón físico en el gestor de entradas GPIO."""
+    if inputs is None:
         return
-    GPIO.output(BUZ_GPIO_PIN, GPIO.HIGH)
-    time.sleep(duration)
-    GPIO.output(BUZ_GPIO_PIN, GPIO.LOW)
+    gpio_cfg = config["gpio"]
+    try:
+        BTN_GPIO_PIN = config["timbre"]["gpio_pin"]
+        inputs.add_input(
+            "timbre",
+            BTN_GPIO_PIN,
+            pullup=config["timbre"].get("pullup", True),
+            handler=on_timbre,
+            bouncetime=gpio_cfg["bouncetime"],
+            holdoff=gpio_cfg["holdoff"],
+        )
+        button_pin = config["button"].get("gpio_pin")
+        if button_pin and button_pin != BTN_GPIO_PIN:
+            inputs.add_input(
+                "button",
+                button_pin,
+                pullup=config["button"].get("pullup", True),
+                handler=on_button,
+                bouncetime=gpio_cfg["bouncetime"],
+                holdoff=gpio_cfg["holdoff"],
+            )
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudieron configurar las entradas GPIO: {e}")
+
+
+def alert(pattern):
+    """Encola un patrón del buzzer (ver buzzer.PATTERNS); no bloquea."""
+    if buzzer is not None:
+        buzzer.alert_pattern(pattern)
+
+
+def beep_card():
+    """Pitido al aceptar una tarjeta (antes de decidir la apertura)."""
+    alert("success")
 
 
 # ------------------------------------------------------------------
 # 📢 EVENTOS EN TIEMPO REAL (SSE)
 # ------------------------------------------------------------------
-event_queue = queue.Queue()
 
 
 @app.route("/events")
 def events():
+    sub = event_bus.subscribe(request.headers.get("Last-Event-ID"))
+    heartbeat = config["events"]["heartbeat"]
+
     def event_stream():
-        while True:
-            event = event_queue.get()
-            yield f"data: {json.dumps(event)}\n\n"
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                pending = sub.get(timeout=heartbeat)
+                if not pending:
+                    # Latido: mantiene viva la conexión y detecta clientes caídos
+                    yield ": ping\n\n"
+                    continue
+                for _, text in pending:
+                    yield text
+        finally:
+            event_bus.unsubscribe(sub)
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Clientes SocketIO conectados (para /metrics) ---
+socketio_clients = 0
+
+
+@socketio.on("connect")
+def on_socketio_connect():
+    global socketio_clients
+    socketio_clients += 1
+
 
-    return Response(stream_with_context(event_stream()), mimetype="text/event-stream")
+@socketio.on("disconnect")
+def on_socketio_disconnect():
+    global socketio_clients
+    socketio_clients -= 1
 
 
 def broadcast_event(event, data):
-    """Envía eventos NFC al panel /admin usando SocketIO"""
+    """Envía el evento al panel por SocketIO y a los clientes SSE (/events)"""
     try:
-        socketio.emit(event, data)
+        # Se puede llamar desde cualquier hilo (lector, GPIO, cerradura)
+        bridge.call(socketio.emit, event, data)
     except Exception as e:
         logger.error(f"Error en broadcast_event: {e}")
+    try:
+        event_bus.publish(event, data)
+    except Exception as e:
+        logger.error(f"Error publicando evento SSE: {e}")
 
 
 # --------------------------------------------
@@ -392,52 +637,43 @@ def broadcast_event(event, data):
 # ------------------------------------------------------------------
 
 
-def on_usuario_detected(id):
+_lookup_hist = metrics.histogram(
+    "vport_card_stage_seconds",
+    "Latencia por etapa de la lectura de tarjeta",
+    stage="lookup",
+)
+_unlock_hist = metrics.histogram(
+    "vport_card_to_unlock_seconds",
+    "Del ETX de la trama UART a la salida GPIO de la cerradura",
+)
+
+
+def on_usuario_detected(id, read_at=None):
     try:
-        conn = db.sqlite3.connect(db.DB_PATH)
-        conn.row_factory = db.sqlite3.Row
-        c = conn.cursor()
-        c.execute(
-            "SELECT * FROM usuarios WHERE id=?",
-            (id,),
-        )
-        row = c.fetchone()
-        conn.close()
-        if row:
-            nombre = row["nombre"]
-            ap = row["ap"]
-            am = row["am"]
-            pwd = row["pwd"]
-            email = row["email"]
-            cell = row["cell"]
-            tipoId = row["tipoId"]
-            fecha = row["fecha"]
-            activo = row["activo"]
-            operador = row["operador"]
+        # Decisión de apertura con la caché en memoria, antes de tocar la DB
+        start = metrics.now()
+        auth = db.lookup_tarjeta(id)
+        _lookup_hist.since(start)
+        activo = bool(auth and auth[0])
+        if activo:
+            activate_lock()
+            if read_at is not None:
+                _unlock_hist.since(read_at)
+            clip = None
         else:
-            nombre = "Desconocido"
-            ap = ""
-            am = ""
-            pwd = ""
-            email = ""
-            cell = ""
-            tipoId = 0
-            fecha = (time.strftime("%Y-%m-%d %H:%M:%S"),)
-            activo = 0
-            operador = 0
+            alert("error")  # interrumpe el pitido de lectura
+            clip = record_clip("denegado")
+        db.log_acceso("tarjeta", id, activo, clip=clip)
 
+        # Sólo datos públicos: /events guarda un historial que se repite a
+        # cualquier cliente (Last-Event-ID), nada de pwd, email ni teléfono
+        nombre = auth[1] if auth else "Desconocido"
         last_usuario = {
             "id": id,
             "nombre": nombre,
-            "ap": ap,
-            "am": am,
-            "pwd": pwd,
-            "email": email,
-            "cell": cell,
-            "tipoId": tipoId,
-            "fecha": fecha,
-            "activo": bool(activo),
-            "operador": bool(operador),
+            "tipoId": auth[2] if auth else 0,
+            "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "activo": activo,
         }
 
         logging.info(
@@ -446,18 +682,13 @@ def on_usuario_detected(id):
 
         broadcast_event("nfc_access", last_usuario)
 
-        if activo:
-            threading.Thread(target=activate_lock, daemon=True).start()
-        else:
+        if not activo:
             logging.warning(f"🚫 Acceso denegado para ID={id}")
 
     except Exception as e:
         logging.error(f"⚠️ Error en on_usuario_detected: {e}")
 
 
-threading.Thread(target=listen_timbre, daemon=True).start()
-
-
 # =========================
 #  PANEL DE ADMINISTRACIÓN
 # ==========================
@@ -485,28 +716,21 @@ def admin():
 def updPwd():
     try:
         pwd = request.get_json()
-        if not pwd:
+        if not pwd or not pwd.get("new_pwd"):
             return jsonify(
                 {"success": False, "error": "La nueva contraseña es requerida"}
             )
 
         newPwd = pwd["new_pwd"]
-        config = db.load_config()
 
-        # Verificar que existe la sección admin
-        if "admin" not in config:
-            return jsonify(
-                {
-                    "success": False,
-                    "error": "Sección admin no encontrada en la configuración",
-                }
-            )
-
-        # Actualizar solo la contraseña del admin
-        config["admin"]["password"] = newPwd
-        config["admin"]["updated_at"] = datetime.now().isoformat()
-
-        db.save_config(config)
+        # Actualizar solo la contraseña del admin (hash bcrypt, escritura atómica)
+        config.update(
+            "admin",
+            {
+                "password": db.hash_password(newPwd),
+                "updated_at": datetime.now().isoformat(),
+            },
+        )
         return jsonify(
             {
                 "success": True,
@@ -541,15 +765,17 @@ def admin_add_():
 
 
 @app.route("/admin/update/<id>", methods=["POST"])
+@admin_required
 def admin_update(id):
     nombre = request.form.get("nombre", "")
     tipoId = request.form.get("tipoId", 2)
     activo = int(request.form.get("activo", 1))
-    db.usuario(id, nombre, tipoId, activo)
+    db.update_usuario(id, nombre, tipoId, activo)
     return redirect(url_for("admin"))
 
 
-@app.route("/admin/delete/<uid>", methods=["POST"])
+@app.route("/admin/delete/<id>", methods=["POST"])
+@admin_required
 def admin_delete(id):
     db.remove_usuario(id)
     return redirect(url_for("admin"))
@@ -559,90 +785,172 @@ def admin_delete(id):
 def guardar_usuario():
     usuario = request.get_json()
     # logging.info(f"usuario --> {usuario}")
-    db.add_usuario(
-        usuario.get("id"),
-        usuario.get("nombre"),
-        usuario.get("ap"),
-        usuario.get("am"),
-        usuario.get("pwd"),
-        usuario.get("email"),
-        usuario.get("cell"),
-        usuario.get("tipoId"),
-        int(usuario.get("activo")),
-        int(usuario.get("operador")),
-    )
-    usuarios = db.list_usuarios()
+    try:
+        db.add_usuario(
+            usuario.get("id"),
+            usuario.get("nombre"),
+            usuario.get("ap"),
+            usuario.get("am"),
+            usuario.get("pwd"),
+            usuario.get("email"),
+            usuario.get("cell"),
+            usuario.get("tipoId"),
+            int(usuario.get("activo")),
+            int(usuario.get("operador")),
+        )
+    except db.HashPoolBusy as e:
+        return jsonify({"mensaje": str(e)}), 503
     return jsonify({"mensaje": "Usuario guardado correctamente"}), 200
 
 
+# ===========   Importación / exportación masiva  ==========
+def _leer_csv(stream):
+    return csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig"))
+
+
+def _leer_ndjson(stream):
+    for linea in io.TextIOWrapper(stream, encoding="utf-8"):
+        if linea.strip():
+            yield json.loads(linea)
+
+
+@app.route("/admin/import", methods=["POST"])
+@admin_required_api
+def admin_import():
+    """Importa usuarios desde CSV o NDJSON (cuerpo del POST o archivo 'file')."""
+    formato = request.args.get("format")
+    if "file" in request.files:
+        archivo = request.files["file"]
+        stream = archivo.stream
+        formato = formato or (
+            "ndjson" if archivo.filename.endswith(".ndjson") else "csv"
+        )
+    else:
+        stream = request.stream
+        formato = formato or (
+            "ndjson" if "ndjson" in (request.mimetype or "") else "csv"
+        )
+
+    filas = _leer_ndjson(stream) if formato == "ndjson" else _leer_csv(stream)
+    try:
+        total = db.import_usuarios(filas)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error al importar usuarios: {e}")
+        return jsonify({"status": "error", "message": "Error al importar"}), 500
+    return jsonify({"status": "ok", "importados": total}), 200
+
+
+@app.route("/admin/export", methods=["GET"])
+@admin_required_api
+def admin_export():
+    """Exporta usuarios como CSV o NDJSON, fila por fila.
+
+    Los hashes de contraseña sólo se incluyen con ?pwd=1."""
+    formato = request.args.get("format", "csv")
+    campos = db.CAMPOS_USUARIO
+    if request.args.get("pwd") != "1":
+        campos = tuple(c for c in campos if c != "pwd")
+
+    def generar_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(campos)
+        for fila in db.export_usuarios(campos):
+            writer.writerow(tuple(fila))
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    def generar_ndjson():
+        for fila in db.export_usuarios(campos):
+            # zip con los nombres: la columna se declaró "Operador" y
+            # dict(fila) no coincidiría con la clave que lee la importación
+            yield json.dumps(dict(zip(campos, fila)), ensure_ascii=False) + "\n"
+
+    if formato == "ndjson":
+        generador, mimetype = generar_ndjson(), "application/x-ndjson"
+    else:
+        formato, generador, mimetype = "csv", generar_csv(), "text/csv"
+    return Response(
+        stream_with_context(generador),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=usuarios.{formato}"},
+    )
+
+
+# ===========   Bitácora de accesos  =======================
+@app.route("/admin/accesos", methods=["GET"])
+@admin_required_api
+def obtener_accesos():
+    """Bitácora paginada por cursor (id del último acceso de la página)."""
+    limite = min(max(request.args.get("limite", 50, type=int), 1), 500)
+    antes = request.args.get("cursor", None, type=int)
+    accesos, next_cursor = db.list_accesos(
+        limite,
+        antes=antes,
+        tipo=request.args.get("tipo") or None,
+        usuarioId=request.args.get("usuario") or None,
+    )
+    return jsonify(
+        {"accesos": [dict(a) for a in accesos], "next_cursor": next_cursor}
+    ), 200
+
+
+@app.route("/admin/accesos/resumen", methods=["GET"])
+@admin_required_api
+def resumen_accesos():
+    """Conteos por hora (UTC): ?desde=YYYY-MM-DD HH:00&hasta=..."""
+    desde = request.args.get("desde") or datetime.utcnow().strftime("%Y-%m-%d 00:00")
+    resumen = db.resumen_accesos(desde, request.args.get("hasta"))
+    return jsonify({"resumen": [dict(r) for r in resumen]}), 200
+
+
+@app.route("/admin/clips/<name>", methods=["GET"])
+@admin_required_api
+def obtener_clip(name):
+    """Clip MJPEG de un acceso (columna `clip` de la bitácora)."""
+    path = clip_recorder.path(name) if clip_recorder else None
+    if path is None:
+        # La bitácora guarda el nombre al ocurrir el evento: el clip puede
+        # seguir grabándose, no haberse grabado (sin frames) o haberse
+        # borrado por cuota
+        mensaje = "Clip no disponible (en grabación, sin video o eliminado por cuota)"
+        return jsonify({"error": mensaje}), 404
+    return send_file(path, mimetype="video/x-motion-jpeg")
+
+
 # ===========   Paginado  =================================
 @app.route("/admin/usuarios", methods=["GET"])
-@login_required_api
+@admin_required_api
 def obtener_usuarios():
     try:
-        # Obtener parámetros de paginación
+        # Paginación por cursor: el cliente envía el next_cursor de la página
+        # anterior; `pagina` sólo se usa para mostrar el número
         pagina = request.args.get("pagina", 1, type=int)
+        cursor = request.args.get("cursor", "", type=str) or None
         por_pagina = request.args.get(
             "por_pagina", 50, type=int
         )  # 50 registros por página
         busqueda = request.args.get("busqueda", "", type=str)
 
         # Validar parámetros
-        if pagina < 1:
+        if pagina < 1 or cursor is None:
             pagina = 1
+        if por_pagina < 1:
+            por_pagina = 50
         if por_pagina > 100:  # Límite máximo
             por_pagina = 100
 
-        # Calcular offset
-        offset = (pagina - 1) * por_pagina
-
-        g.db = db.sqlite3.connect(db.DB_PATH)
-        g.db.row_factory = db.sqlite3.Row
-
-        dbase = g.db
-
-        # Construir consulta base con búsqueda
-        query_base = """
-            SELECT u.*, t.tipo
-            FROM usuarios u
-            LEFT JOIN tipoUsuario t ON u.tipoId = t.id
-        """
-
-        query_contar = "SELECT COUNT(*) as total FROM usuarios u"
-
-        params = []
-        where_conditions = []
-
-        if busqueda:
-            where_conditions.append("""
-                (u.nombre LIKE ? OR u.ap LIKE ? OR u.email LIKE ? OR u.id LIKE ?)
-            """)
-            param_busqueda = f"%{busqueda}%"
-            params.extend(
-                [param_busqueda, param_busqueda, param_busqueda, param_busqueda]
-            )
-
-        # Aplicar WHERE si hay condiciones
-        if where_conditions:
-            where_clause = " WHERE " + " AND ".join(where_conditions)
-            query_base += where_clause
-            query_contar += where_clause
-
-        # Ordenar y paginar
-        query_base += " ORDER BY u.fecha DESC LIMIT ? OFFSET ?"
-        params.extend([por_pagina, offset])
-
-        # Ejecutar consulta para obtener usuarios
-        usuarios = dbase.execute(query_base, params).fetchall()
-
-        # Ejecutar consulta para contar total
-        total_result = dbase.execute(
-            query_contar, params[:-2] if busqueda else []
-        ).fetchone()
-        total_usuarios = total_result["total"]
+        try:
+            usuarios, next_cursor = db.buscar_usuarios(busqueda, por_pagina, cursor)
+        except (ValueError, TypeError):
+            return jsonify({"error": "Cursor inválido"}), 400
 
-        # Calcular total de páginas
-        total_paginas = math.ceil(total_usuarios / por_pagina)
+        # Total aproximado (cacheado unos segundos)
+        total_usuarios = db.contar_usuarios(busqueda)
+        total_paginas = max(pagina, math.ceil(total_usuarios / por_pagina))
 
         # Convertir a lista de diccionarios
         usuarios_list = [dict(usuario) for usuario in usuarios]
@@ -656,7 +964,8 @@ def obtener_usuarios():
                     "total_usuarios": total_usuarios,
                     "total_paginas": total_paginas,
                     "has_prev": pagina > 1,
-                    "has_next": pagina < total_paginas,
+                    "has_next": next_cursor is not None,
+                    "next_cursor": next_cursor,
                 },
             }
         ), 200
@@ -666,31 +975,153 @@ def obtener_usuarios():
         return jsonify({"error": "Error al obtener usuarios"}), 500
 
 
+# ------------------------------------------------------------------
+# 📊 Métricas (Prometheus)
+# ------------------------------------------------------------------
+metrics.gauge("vport_threads", "Hilos vivos del proceso", threading.active_count)
+metrics.gauge(
+    "vport_stream_clients",
+    "Clientes de /video_feed por perfil",
+    lambda: [({"profile": n}, b.clients) for n, b in pipeline.broadcasters.items()],
+)
+metrics.gauge(
+    "vport_sse_clients", "Clientes SSE de /events", lambda: event_bus.subscribers
+)
+metrics.gauge(
+    "vport_socketio_clients", "Clientes SocketIO conectados", lambda: socketio_clients
+)
+metrics.gauge(
+    "vport_camera_running",
+    "1 si la cámara está encendida",
+    lambda: int(camera_manager.running),
+)
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# ------------------------------------------------------------------
+# 🏭 Fábrica y ciclo de vida
+# ------------------------------------------------------------------
+def create_app(settings=None):
+    """Arma la aplicación sin tocar hardware y la devuelve.
+
+    Configura Flask/SocketIO, el puente según el modo del servidor, la
+    cámara (apagada hasta el primer consumidor), los clips, el login y el
+    bus de eventos. El hardware se enciende con start().
+    """
+    global config, SERVER_MODE, bridge, camera_manager, camera_executor, pipeline
+    global clip_recorder, login_manager, event_bus
+    config = settings or Settings()
+    SERVER_MODE = config["server"]["mode"]
+    if SERVER_MODE not in MODES:
+        SERVER_MODE = "werkzeug"
+    bridge = create_bridge(SERVER_MODE)
+
+    # La cámara arranca con el primer cliente de /video_feed y se apaga sola
+    camera_manager = camera.CameraManager(
+        config["camera"], on_motion=lambda data: broadcast_event("motion", data)
+    )
+    camera_executor = bridge.executor(1, thread_name_prefix="camera")
+    pipeline = camera_manager.pipeline
+    clip_recorder = create_clip_recorder()
+
+    db.configure_hashing(
+        rounds=config["security"].get("bcrypt_rounds"),
+        workers=config["security"].get("hash_workers"),
+        max_queue=config["security"].get("hash_queue"),
+        executor=bridge.executor,
+    )
+    # Cuenta admin en memoria y límite de intentos por IP y por usuario
+    login_manager = LoginManager(config["admin"], **config["security"]["login"])
+    event_bus = EventBus(
+        bridge.notifier(),
+        history=config["events"]["history"],
+        queue_size=config["events"]["queue_size"],
+    )
+
+    app.secret_key = config["security"]["pwd"]
+    # Configurar expiración de sesión
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
+        minutes=config["security"]["sessionTime"]
+    )
+    app.config["SESSION_REFRESH_EACH_REQUEST"] = True  # Renovar con cada request
+    CORS(app)
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=bridge.async_mode)
+
+    config.subscribe("camera", camera_manager.reconfigure)
+    config.subscribe("admin", login_manager.set_admin)
+    config.subscribe("lock", on_lock_config)
+    config.subscribe("buzzer", on_buzzer_config)
+    config.subscribe("logging", on_logging_config)
+    return app
+
+
+def start_db():
+    db.init_db()
+    db.load_auth_cache()
+    db.start_access_log(**config["accesos"])
+
+
+def start_reader():
+    nfcModule.start_reader(on_usuario_detected, on_read=beep_card, **config["nfc"])
+    logger.info("📡 Lector NFC (RDM6300) iniciado")
+
+
+def start():
+    """Enciende los subsistemas.
+
+    DB y GPIO se inicializan en paralelo y el lector arranca en cuanto
+    ambos están listos. La cámara arranca por separado: nunca retrasa ni
+    impide abrir la puerta con tarjeta.
+    """
+    inicio = time.monotonic()
+    threading.Thread(target=start_camera, name="camera-init", daemon=True).start()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="init") as pool:
+        db_listo = pool.submit(start_db)
+        gpio_listo = pool.submit(start_gpio)
+    gpio_listo.result()
+    db_listo.result()  # sin DB no hay autorización: este error sí detiene el arranque
+    start_reader()
+    config.watch()
+    logger.info(f"🚪 Puerta lista en {time.monotonic() - inicio:.2f}s")
+
+
+def stop():
+    """Apaga los subsistemas en orden inverso al arranque."""
+    config.stop()
+    nfcModule.stop_reader()
+    camera_manager.shutdown()
+    camera_executor.shutdown(wait=False)
+    stop_gpio()
+    db.stop_access_log()
+    db.close_pool()
+    logger.info("🧹 Servidor detenido correctamente")
+
+
 # ------------------------------------------------------------------
 # 🏁 Main Prog section
 # ------------------------------------------------------------------
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=getattr(logging, _settings["logging"]["level"].upper(), logging.INFO),
+        format="%(asctime)s [%(levelname)s] %(message)s",
+    )
+    create_app(_settings)
     try:
-        # Iniciar lector NFC en segundo plano
-        db.init_db()
-        threading.Thread(
-            target=nfcModule.start_reader, args=(on_usuario_detected,), daemon=True
-        ).start()
-        logger.info(
-            "📡 Lector NFC (RDM6300) iniciado        # nfcModule.start_reader(on_usuario_detected) en hilo de fondo"
-        )
-
+        start()
+        logger.info(f"🌐 Servidor en modo {SERVER_MODE}")
+        run_kwargs = {}
+        if SERVER_MODE == "werkzeug":
+            run_kwargs["allow_unsafe_werkzeug"] = True
         socketio.run(
             app,
             host=config["server"]["host"],
             port=config["server"]["port"],
             debug=config["server"]["debug"],
-            allow_unsafe_werkzeug=True,
+            **run_kwargs,
         )
     finally:
-        running = False
-        picam2.stop()
-        if GPIO:
-            GPIO.cleanup()
-        nfcModule.reader_running = False
-        logger.info("🧹 Servidor detenido correctamente")
+        stop()
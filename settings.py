@@ -0,0 +1,278 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = "config.json"
+
+
+# ------------------------------------------------------------------
+# 🔧 Configuración por defecto (también es el esquema)
+# ------------------------------------------------------------------
+# Cada valor define el tipo esperado de la clave; None acepta cualquiera.
+DEFAULT_CONFIG = {
+    "camera": {
+        "resolution": [640, 480],
+        "format": "XBGR8888",
+        "frame_interval": 0.05,
+        "enabled": True,  # sin cámara la puerta sigue funcionando con tarjeta
+        "backend": "picamera2",  # "picamera2" | "fake"
+        "pipeline": "encoder",  # "encoder" (MJPEG/JPEG de Picamera2) | "capture"
+        "encoder": "mjpeg",  # "mjpeg" (hardware) | "jpeg"
+        "fps": 30,
+        "idle_timeout": 30.0,  # segundos sin consumidores antes de apagar la cámara
+        "always_on": False,  # mantener la cámara encendida (p. ej. para movimiento)
+        "lores_resolution": [320, 240],
+        # Perfiles de /video_feed?profile=...: stream de origen y tope de fps
+        "profiles": {
+            "thumb": {"stream": "lores", "fps": 5},
+            "std": {"stream": "main", "fps": 20},
+            "hd": {"stream": "main", "fps": 30},
+        },
+        "default_profile": "std",
+        # Detección de movimiento sobre lores: sin movimiento ni clientes se
+        # publica a idle_fps
+        "motion": {
+            "enabled": True,
+            "interval": 0.2,
+            "threshold": 0.02,
+            "pixel_threshold": 25,
+            "downscale": 4,
+            "hold": 10.0,
+            "idle_fps": 1.0,
+        },
+    },
+    # mode: "werkzeug" (desarrollo) | "gevent" (producción, cooperativo)
+    "server": {"host": "0.0.0.0", "port": 5000, "debug": False, "mode": "werkzeug"},
+    # max_duration: tope de segundos abierta por apertura (/api/open incluido)
+    "lock": {
+        "gpio_pin": 17,
+        "active_high": True,
+        "unlock_duration": 3.0,
+        "max_duration": 30.0,
+    },
+    "button": {"gpio_pin": 27, "pullup": True},
+    "timbre": {"gpio_pin": 27, "pullup": True},
+    # "rpi" (RPi.GPIO) | "sim" (GPIO simulado, sin Raspberry Pi)
+    "gpio": {"backend": "rpi", "bouncetime": 200, "holdoff": 2.0},
+    "admin": {"username": "admin", "password": "", "updated_at": ""},
+    "security": {
+        "api_token": "1234",
+        "pwd": "",  # secret_key de Flask
+        "sessionTime": 30,  # minutos
+        "bcrypt_rounds": 12,
+        "hash_workers": 2,  # hilos de bcrypt
+        "hash_queue": 8,  # operaciones en espera antes de responder 503
+        # Intentos de login: `burst` seguidos y luego `rate` por segundo
+        "login": {"ip_rate": 0.2, "ip_burst": 10, "user_rate": 0.05, "user_burst": 5},
+    },
+    "logging": {"level": "INFO"},
+    "buzzer": {"gpio_pin": 18, "duration": 0.5},
+    # Lector NFC: tarjetas en espera del despachador y qué hacer con la cola
+    # llena ("drop_oldest" | "drop_newest")
+    "nfc": {"queue_size": 8, "policy": "drop_oldest"},
+    # Bitácora de accesos: lote cada flush_interval s o batch_size eventos
+    "accesos": {
+        "flush_interval": 0.5,
+        "batch_size": 100,
+        "retention_days": 90,
+        "rollup_retention_days": 730,
+        "queue_size": 10000,
+        "max_retries": 5,  # reintentos de un lote fallido (espera doble cada vez)
+        "retry_delay": 1.0,
+    },
+    # SSE: eventos guardados para Last-Event-ID, cola por cliente, latido (s)
+    "events": {"history": 200, "queue_size": 100, "heartbeat": 15},
+    # Clips de video alrededor de eventos (tarjeta denegada, timbre):
+    # `pre`/`post` segundos del perfil indicado, cuota del directorio en MB
+    "clips": {
+        "enabled": True,
+        "directory": "clips",
+        "profile": "std",
+        "pre": 3.0,
+        "post": 3.0,
+        "quota_mb": 500,
+        "events": ["denegado", "timbre"],
+    },
+}
+
+
+# Secciones que se pasan como **kwargs a un constructor (AccessLogWriter,
+# CardDispatcher, LoginManager): una clave desconocida sería un TypeError
+# al arrancar, así que se descarta con aviso en lugar de copiarse.
+FIXED_SECTIONS = {"config.accesos", "config.nfc", "config.security.login"}
+
+
+def _check(default, value, path, errores):
+    """Valida `value` contra el tipo de `default`; devuelve el valor a usar."""
+    if default is None:
+        return copy.deepcopy(value)
+    if isinstance(default, dict):
+        if not isinstance(value, dict):
+            errores.append(f"{path}: se esperaba un objeto")
+            return copy.deepcopy(default)
+        merged = copy.deepcopy(default)
+        for key, val in value.items():
+            if key in default:
+                merged[key] = _check(default[key], val, f"{path}.{key}", errores)
+            elif path in FIXED_SECTIONS:
+                errores.append(f"{path}.{key}: clave desconocida, se ignora")
+            else:
+                merged[key] = copy.deepcopy(val)
+        return merged
+    if isinstance(default, bool):
+        ok = isinstance(value, bool)
+    elif isinstance(default, float):
+        ok = isinstance(value, (int, float)) and not isinstance(value, bool)
+        value = float(value) if ok else value
+    elif isinstance(default, int):
+        ok = isinstance(value, int) and not isinstance(value, bool)
+    else:
+        ok = isinstance(value, type(default))
+    if not ok:
+        errores.append(
+            f"{path}: se esperaba {type(default).__name__}, no {type(value).__name__}"
+        )
+        return copy.deepcopy(default)
+    return copy.deepcopy(value)
+
+
+def parse(raw, defaults=DEFAULT_CONFIG):
+    """Combina el JSON del usuario con los valores por defecto.
+
+    Devuelve (config, errores); las claves con tipo inválido conservan el
+    valor por defecto y las desconocidas se copian tal cual, salvo en
+    FIXED_SECTIONS, donde se descartan.
+    """
+    errores = []
+    return _check(defaults, raw, "config", errores), errores
+
+
+# ------------------------------------------------------------------
+# ♻️ Configuración compartida con recarga en caliente
+# ------------------------------------------------------------------
+class Settings:
+    """Configuración leída una sola vez y compartida por todo el servidor.
+
+    settings["camera"] devuelve la sección ya validada sin tocar el disco.
+    watch() revisa cada `interval` segundos la fecha de modificación del
+    archivo; si cambió, lo vuelve a leer y llama a los suscriptores de
+    cada sección modificada con la sección nueva. update() escribe el
+    archivo de forma atómica (archivo temporal + rename).
+    """
+
+    def __init__(self, path=CONFIG_FILE, defaults=DEFAULT_CONFIG):
+        self.path = path
+        self.defaults = defaults
+        self._lock = threading.RLock()
+        self._subscribers = {}
+        self._raw = {}
+        self._stat = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.data, _ = parse({}, defaults)
+        self.reload(force=True)
+
+    def __getitem__(self, section):
+        return self.data[section]
+
+    def __contains__(self, section):
+        return section in self.data
+
+    def get(self, section, default=None):
+        return self.data.get(section, default)
+
+    def subscribe(self, section, fn):
+        """fn(sección_nueva) se llama cada vez que cambia `section`."""
+        with self._lock:
+            self._subscribers.setdefault(section, []).append(fn)
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def reload(self, force=False):
+        """Relee el archivo si cambió; devuelve las secciones modificadas."""
+        with self._lock:
+            stat = self._file_stat()
+            if not force and stat == self._stat:
+                return []
+            self._stat = stat
+            if stat is None:
+                logger.warning(
+                    f"⚠️ No se encontró {self.path}, usando configuración por defecto."
+                )
+                raw = {}
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        raw = json.load(f)
+                except (OSError, ValueError) as e:
+                    # Un archivo a medio editar no debe tirar la configuración vigente
+                    logger.error(f"⚠️ Error leyendo {self.path}: {e}")
+                    return []
+            data, errores = parse(raw, self.defaults)
+            for error in errores:
+                logger.warning(f"⚠️ Configuración inválida en {error}")
+            old, self.data, self._raw = self.data, data, raw
+            cambios = [k for k in data if old.get(k) != data[k]]
+            if not force:
+                logger.info(
+                    f"♻️ Configuración recargada: {', '.join(cambios) or 'sin cambios'}"
+                )
+            subscribers = {k: list(self._subscribers.get(k, ())) for k in cambios}
+        for section, fns in subscribers.items():
+            for fn in fns:
+                try:
+                    fn(data[section])
+                except Exception as e:
+                    logger.error(f"⚠️ Error aplicando configuración '{section}': {e}")
+        return cambios
+
+    def update(self, section, values):
+        """Actualiza claves de una sección, guarda el archivo y notifica."""
+        with self._lock:
+            raw = copy.deepcopy(self._raw)
+            raw.setdefault(section, {}).update(values)
+            self._write(raw)
+            return self.reload(force=True)
+
+    def _write(self, raw):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(raw, f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def watch(self, interval=2.0):
+        """Arranca el hilo que recarga el archivo cuando cambia."""
+
+        def loop():
+            while not self._stop.wait(interval):
+                self.reload()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
@@ -2,6 +2,8 @@ let paginaActual = 1;
 let porPagina = 25;
 let busquedaActual = "";
 let totalPaginas = 1;
+// cursores[n] = cursor para pedir la página n (paginación por cursor)
+let cursores = { 1: "" };
 let data = {};
 let Modo = "edit";
 
@@ -40,8 +42,12 @@ async function cargarUsuarios(pagina = 1) {
     mostrarLoading(true);
 
     try {
+        if (pagina === 1) {
+            cursores = { 1: "" };
+        }
         const params = new URLSearchParams({
             pagina: pagina,
+            cursor: cursores[pagina] || "",
             por_pagina: porPagina,
             busqueda: busquedaActual,
         });
@@ -56,6 +62,9 @@ async function cargarUsuarios(pagina = 1) {
         if (response.ok) {
             paginaActual = data.paginacion.pagina_actual;
             totalPaginas = data.paginacion.total_paginas;
+            if (data.paginacion.next_cursor) {
+                cursores[paginaActual + 1] = data.paginacion.next_cursor;
+            }
 
             mostrarUsuarios(data.usuarios);
             actualizarPaginacion(data.paginacion);
@@ -145,12 +154,11 @@ function generarPaginacionHTML(paginacion) {
         <i class="fa fa-angle-left" aria-hidden="true"></i> </button>`;
     }
 
-    // Números de página (mostrar solo algunas páginas alrededor de la actual)
+    // Números de página: sólo las ya visitadas (tienen cursor) y la siguiente
     const inicio = Math.max(1, paginacion.pagina_actual - 2);
-    const fin = Math.min(
-        paginacion.total_paginas,
-        paginacion.pagina_actual + 2,
-    );
+    const fin = paginacion.has_next
+        ? paginacion.pagina_actual + 1
+        : paginacion.pagina_actual;
 
     for (let i = inicio; i <= fin; i++) {
         if (i === paginacion.pagina_actual) {
@@ -160,12 +168,10 @@ function generarPaginacionHTML(paginacion) {
         }
     }
 
-    // Botón Última página
+    // Botón Página siguiente
     if (paginacion.has_next) {
         html += `<button onclick="irAPagina(${paginacion.pagina_actual + 1})">
         <i class="fa fa-angle-right" aria-hidden="true"></i></button>`;
-        html += `<button onclick="irAPagina(${paginacion.total_paginas})">
-        <i class="fa fa-angle-double-right" aria-hidden="true"></i></button>`;
     }
 
     return html;
@@ -173,7 +179,7 @@ function generarPaginacionHTML(paginacion) {
 
 // Ir a página específica
 function irAPagina(pagina) {
-    if (pagina >= 1 && pagina <= totalPaginas) {
+    if (pagina >= 1 && pagina in cursores) {
         cargarUsuarios(pagina);
     }
 }
@@ -200,8 +206,8 @@ function actualizarInfoPaginacion(paginacion) {
     );
 
     document.getElementById("infoPaginacion").innerHTML = `
-     Mostrando ${inicio} - ${fin} de ${paginacion.total_usuarios} usuarios
-     | Página ${paginacion.pagina_actual} de ${paginacion.total_paginas}
+     Mostrando ${inicio} - ${fin} de ~${paginacion.total_usuarios} usuarios
+     | Página ${paginacion.pagina_actual} de ~${paginacion.total_paginas}
      | <select onchange="cambiarRegistrosPorPagina(this.value)">
          <option value="25" ${porPagina === 25 ? "selected" : ""}>25 por página</option>
          <option value="50" ${porPagina === 50 ? "selected" : ""}>50 por página</option>
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""Benchmarks sin hardware de los caminos calientes de vport.
+
+Corre en cualquier máquina: usa la cámara simulada (camera.backend
+"fake"), el GPIO simulado (gpio.backend "sim") y un puerto serial falso.
+Todo ocurre en un directorio temporal con su propia config.json y DB.
+
+    python utils/bench.py [--quick] [--out resultados.json]
+
+El resultado es JSON para comparar entre versiones.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gpioModule  # noqa: E402
+
+BENCH_CONFIG = {
+    "camera": {
+        "backend": "fake",
+        "pipeline": "encoder",
+        "fps": 30,
+        "idle_timeout": 1.0,
+        "profiles": {"std": {"stream": "main", "fps": 30}},
+        "default_profile": "std",
+        "motion": {"enabled": False},
+    },
+    "server": {"mode": "werkzeug"},
+    "gpio": {"backend": "sim"},
+    "security": {"pwd": "bench"},
+    "logging": {"level": "WARNING"},
+    "clips": {"enabled": False},
+}
+
+
+# ------------------------------------------------------------------
+# 🧪 Backends falsos
+# ------------------------------------------------------------------
+class FakeSerial:
+    """Puerto serial que entrega `data` en trozos, como el UART del RDM6300."""
+
+    def __init__(self, data, chunk=64):
+        self._data = memoryview(bytes(data))
+        self._pos = 0
+        self._chunk = chunk
+
+    @property
+    def in_waiting(self):
+        return min(self._chunk, len(self._data) - self._pos)
+
+    def read(self, size=1):
+        out = self._data[self._pos : self._pos + size].tobytes()
+        self._pos += len(out)
+        return out
+
+    @property
+    def done(self):
+        return self._pos >= len(self._data)
+
+
+def install_fakes():
+    """Registra RPi.GPIO simulado (y pyserial falso si no está instalado)."""
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpioModule.SimulatedGPIO()
+    sys.modules.setdefault("RPi", rpi)
+    sys.modules.setdefault("RPi.GPIO", rpi.GPIO)
+    try:
+        import serial  # noqa: F401
+    except ImportError:
+        fake = types.ModuleType("serial")
+        fake.Serial = FakeSerial
+        fake.SerialException = OSError
+        sys.modules["serial"] = fake
+
+
+def card_frame(card_id):
+    """Trama RDM6300 válida para un ID de 8 dígitos hex (versión 0x01)."""
+    data = "01" + card_id
+    checksum = 0
+    for i in range(0, 10, 2):
+        checksum ^= int(data[i : i + 2], 16)
+    return b"\x02" + f"{data}{checksum:02X}".encode("ascii") + b"\x03"
+
+
+# ------------------------------------------------------------------
+# 📏 Utilidades
+# ------------------------------------------------------------------
+def latencies(samples):
+    """Resumen en milisegundos de una lista de segundos."""
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pct(p):
+        return round(samples[min(n - 1, int(p * n))] * 1000, 4)
+
+    return {
+        "n": n,
+        "mean_ms": round(statistics.fmean(samples) * 1000, 4),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": round(samples[-1] * 1000, 4),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latencies(samples)
+
+
+NOMBRES = [
+    "Ana",
+    "Luis",
+    "María",
+    "José",
+    "Carmen",
+    "Jorge",
+    "Lucía",
+    "Pedro",
+    "Sofía",
+    "Raúl",
+]
+APELLIDOS = [
+    "García",
+    "López",
+    "Martínez",
+    "Hernández",
+    "Pérez",
+    "Sánchez",
+    "Ramírez",
+    "Torres",
+]
+
+
+def usuarios(n, rng):
+    for i in range(n):
+        yield {
+            "id": f"{i:08X}",
+            "nombre": rng.choice(NOMBRES),
+            "ap": rng.choice(APELLIDOS),
+            "am": rng.choice(APELLIDOS),
+            "email": f"user{i}@example.com",
+            "tipoId": 2,
+            "activo": 1 if i % 10 else 0,
+        }
+
+
+# ------------------------------------------------------------------
+# 🏁 Benchmarks
+# ------------------------------------------------------------------
+def bench_uart(nfcModule, frames):
+    """Throughput de parse_frames y del ciclo del lector con un serial falso."""
+    rng = random.Random(1)
+    stream = bytearray()
+    for i in range(frames):
+        stream += card_frame(f"{i:08X}")
+        if i % 50 == 0:
+            stream += bytes(rng.randrange(4, 256) for _ in range(5))  # basura
+
+    start = time.perf_counter()
+    buffer = bytearray()
+    parsed = 0
+    for i in range(0, len(stream), 64):
+        buffer += stream[i : i + 64]
+        ids, consumed = nfcModule.parse_frames(buffer)
+        del buffer[:consumed]
+        parsed += len(ids)
+    parse_s = time.perf_counter() - start
+
+    # Ciclo completo del lector (lectura por lotes + anti-rebote + cola)
+    # con un callback inmediato y con uno lento (DB ocupada)
+    result = {
+        "frames": frames,
+        "bytes": len(stream),
+        "parse_frames_per_s": round(parsed / parse_s),
+        "parse_mb_per_s": round(len(stream) / parse_s / 1e6, 2),
+    }
+    for name, delay, queue_size in (("reader", 0, frames), ("reader_slow", 0.005, 8)):
+        result[name] = run_reader(nfcModule, stream, delay, queue_size)
+    return result
+
+
+def run_reader(nfcModule, stream, delay, queue_size):
+    recibidos = []
+    fake = FakeSerial(stream)
+
+    class Port:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return fake
+
+        def __exit__(self, *exc):
+            return False
+
+    def callback(id, read_at=None):
+        if delay:
+            time.sleep(delay)
+        recibidos.append(id)
+
+    original = nfcModule.serial.Serial
+    nfcModule.serial.Serial = Port
+    try:
+        start = time.perf_counter()
+        nfcModule.start_reader(callback, queue_size=queue_size)
+        while not fake.done and time.perf_counter() - start < 60:
+            time.sleep(0.01)
+        reader_s = time.perf_counter() - start
+        dispatcher = nfcModule._dispatcher
+        while dispatcher.depth and time.perf_counter() - start < 60:
+            time.sleep(0.01)
+        nfcModule.stop_reader()
+    finally:
+        nfcModule.serial.Serial = original
+
+    return {
+        "read_frames_per_s": round(dispatcher.queued / reader_s),
+        "handled": len(recibidos),
+        "dropped": dispatcher.dropped,
+        "coalesced": dispatcher.coalesced,
+    }
+
+
+def bench_card(server, db, n_users, calls):
+    """Latencia de on_usuario_detected con `n_users` usuarios en la DB."""
+    rng = random.Random(n_users)
+    with db.connection() as conn:
+        conn.execute("DELETE FROM usuarios")
+        conn.commit()
+    start = time.perf_counter()
+    db.import_usuarios(usuarios(n_users, rng))
+    import_s = time.perf_counter() - start
+
+    ids = [f"{rng.randrange(n_users):08X}" for _ in range(calls)]
+    # 10% de tarjetas desconocidas
+    ids[::10] = [f"F{rng.randrange(1 << 28):07X}" for _ in ids[::10]]
+    it = iter(ids)
+    result = timed(lambda: server.on_usuario_detected(next(it)), calls)
+    result["users"] = n_users
+    result["import_rows_per_s"] = round(n_users / import_s)
+    return result
+
+
+def bench_usuarios_api(server, pages, repeat):
+    """Latencia de /admin/usuarios: primera página, páginas por cursor y búsquedas."""
+    client = server.app.test_client()
+    with client.session_transaction() as s:
+        s["user_id"] = "bench"
+        s["role"] = "admin"
+
+    def get(query):
+        response = client.get("/admin/usuarios" + query)
+        assert response.status_code == 200, response.status_code
+        return response.get_json()
+
+    result = {"first_page": timed(lambda: get("?por_pagina=50"), repeat)}
+
+    samples = []
+    cursor = None
+    for pagina in range(1, pages + 1):
+        query = f"?por_pagina=50&pagina={pagina}"
+        if cursor:
+            query += f"&cursor={cursor}"
+        start = time.perf_counter()
+        data = get(query)
+        samples.append(time.perf_counter() - start)
+        cursor = data["paginacion"]["next_cursor"]
+        if not cursor:
+            break
+    result["cursor_pages"] = latencies(samples)
+
+    for name, term in (
+        ("search_name", "Lucía"),
+        ("search_prefix", "Mart"),
+        ("search_id", "0000A"),
+    ):
+        result[name] = timed(lambda: get(f"?por_pagina=50&busqueda={term}"), repeat)
+    return result
+
+
+def bench_mjpeg(server, clients, seconds):
+    """Reparto MJPEG: frames entregados a `clients` lectores simultáneos."""
+    broadcaster = server.pipeline.broadcaster()
+    counts = [0] * clients
+    deadline = time.perf_counter() + seconds
+    seq_start = broadcaster.seq
+
+    def consume(i):
+        frames = 0
+        for chunk in server.generate_stream(broadcaster):
+            if chunk.startswith(b"--frame"):
+                frames += 1
+            if time.perf_counter() > deadline:
+                break
+        counts[i] = frames
+
+    cpu = time.process_time()
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    cpu = time.process_time() - cpu
+    published = broadcaster.seq - seq_start
+    return {
+        "clients": clients,
+        "seconds": seconds,
+        "published_fps": round(published / seconds, 1),
+        "delivered_fps_per_client": round(statistics.fmean(counts) / seconds, 1),
+        "min_client_fps": round(min(counts) / seconds, 1),
+        "cpu_s_per_s": round(cpu / seconds, 3),
+    }
+
+
+def bench_socketio(server, clients, events):
+    """Ritmo de socketio.emit con `clients` clientes de prueba conectados."""
+    test_clients = [server.socketio.test_client(server.app) for _ in range(clients)]
+    payload = {"id": "0000ABCD", "nombre": "Bench", "activo": True}
+    start = time.perf_counter()
+    for _ in range(events):
+        server.socketio.emit("nfc_access", payload)
+    elapsed = time.perf_counter() - start
+    received = min(len(c.get_received()) for c in test_clients)
+    for c in test_clients:
+        c.disconnect()
+    return {
+        "clients": clients,
+        "events": events,
+        "emits_per_s": round(events / elapsed),
+        "deliveries_per_s": round(events * clients / elapsed),
+        "min_received": received,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="tamaños reducidos")
+    parser.add_argument("--out", help="archivo JSON (por defecto stdout)")
+    args = parser.parse_args()
+
+    q = args.quick
+    out = os.path.abspath(args.out) if args.out else None
+    workdir = tempfile.mkdtemp(prefix="vport-bench-")
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        json.dump(BENCH_CONFIG, f)
+    os.chdir(workdir)
+    install_fakes()
+
+    import db
+
+    db.DB_PATH = os.path.join(workdir, "vport.db")
+    import nfcModule
+    import server
+    from settings import Settings
+
+    server.create_app(Settings())
+    server.start_db()
+    server.start_gpio()
+
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "quick": q,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "uart": bench_uart(nfcModule, 2000 if q else 20000),
+        "card": [],
+        "usuarios_api": {},
+    }
+    for n_users in (1000, 10000) if q else (1000, 100000):
+        results["card"].append(bench_card(server, db, n_users, 200 if q else 2000))
+        results["usuarios_api"][str(n_users)] = bench_usuarios_api(
+            server, 10 if q else 50, 20 if q else 100
+        )
+    results["mjpeg"] = [
+        bench_mjpeg(server, n, 1.0 if q else 3.0)
+        for n in ((1, 10) if q else (1, 10, 50))
+    ]
+    results["socketio"] = [
+        bench_socketio(server, n, 200 if q else 2000)
+        for n in ((1, 10) if q else (1, 10, 50))
+    ]
+
+    server.stop()
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if out:
+        with open(out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()